@@ -23,25 +23,180 @@ Extension to create cut and fold book art pattern.
 Technically it simply creates vertical lines and clips the pattern.
 """
 
+import copy
+import cProfile
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from bisect import bisect_left, insort
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import count
 from math import ceil
 
+import numpy as np
+from lxml import etree
+
 from inkex import (
+    AbortExtension,
     Boolean,
-    Circle,
+    BoundingBox,
     ClipPath,
     EffectExtension,
-    Ellipse,
     Group,
     Layer,
+    Path,
     PathElement,
-    Rectangle,
+    Style,
     TextElement,
     Transform,
     Tspan,
+    Use,
+    addNS,
 )
 from inkex.colors import Color
 
 
+class Settings:
+    """Book and output settings, lengths are in user units
+
+    The derived values are computed once, impossible combinations raise a ValueError.
+    Settings can't be changed after they are created, they are hashable and can be
+    used as cache keys. The defaults are also the defaults of the command line options
+    (lengths in mm, the default units).
+    """
+
+    DEFAULTS = {
+        "first_page": 0,
+        "last_page": 250,
+        "pages_before": 0,
+        "pages_after": 0,
+        "document_format": "a4",
+        "page_width": 210.0,
+        "page_height": 297.0,
+        "page_margins": 1.0,
+        "font_size": 4.0,
+        "book_height": 250.0,
+        "line_distance": 1.5,
+        "margin_bottom": 0.0,
+        "stroke_width": 0.265,
+        "design_color": "black",
+        "highlight_colors": ("#f9f06b", "#ffbe6f", "#ed333b"),
+        "keep_pattern_color": False,
+        "clip_method": "clip_path",
+        "keep_design": False,
+        "flatness": None,
+        "simplify": 0,
+        "precision": None,
+        "unit_size": 1.0,
+    }
+    CLIP_METHODS = ("clip_path", "page_clip_path", "scanline", "raster")
+    DERIVED = (
+        "total_pages",
+        "design_pages",
+        "first_line",
+        "last_line",
+        "content_width",
+        "lines_per_page",
+        "num_pages",
+    )
+    __slots__ = tuple(DEFAULTS) + DERIVED
+
+    def __init__(self, **values):
+        unknown = set(values) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"unknown settings: {', '.join(sorted(unknown))}")
+        values = dict(self.DEFAULTS, **values)
+        values["highlight_colors"] = tuple(values["highlight_colors"])
+        self._set(values)
+
+        total_pages = (self.last_page - self.first_page) / 2
+        # width of the document page without the margins
+        content_width = self.page_width - self.page_margins * 2
+        self._set(
+            {
+                "total_pages": total_pages,
+                "design_pages": total_pages - self.pages_before - self.pages_after,
+                # line numbers (one line for two page numbers)
+                "first_line": ceil(self.first_page / 2),
+                "last_line": ceil(self.last_page / 2),
+                "content_width": content_width,
+            }
+        )
+        self.validate()
+        self._set(
+            {
+                "lines_per_page": ceil(content_width / self.line_distance),
+                "num_pages": ceil(self.line_distance * total_pages / content_width),
+            }
+        )
+
+    def _set(self, values):
+        """sets the values (assignments are refused)"""
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"settings can't be changed ({name})")
+
+    def __setstate__(self, state):
+        # unpickling (worker processes) sets the slots
+        self._set(state[1])
+
+    def validate(self):
+        """raises a ValueError for settings which can't produce a pattern"""
+        if self.design_pages <= 0:
+            raise ValueError(
+                f"No pages left for the design: {self.total_pages:g} sheets "
+                f"(pages {self.first_page} to {self.last_page}), "
+                f"{self.pages_before} before and {self.pages_after} after the design"
+            )
+        if self.line_distance <= 0:
+            raise ValueError("The line distance must be greater than 0")
+        if self.clip_method not in self.CLIP_METHODS:
+            raise ValueError(
+                f"Unknown clip method {self.clip_method!r}, "
+                f"use one of {', '.join(self.CLIP_METHODS)}"
+            )
+        if self.content_width < self.line_distance:
+            raise ValueError(
+                "The page margins leave no room for the lines: the page content "
+                f"({self.content_width:g}) is narrower than the line distance "
+                f"({self.line_distance:g})"
+            )
+
+    def to_dict(self):
+        """returns the settings (without derived values) as a dictionary"""
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    def key(self):
+        """returns the settings as a tuple of hashable values (colors as strings)"""
+        values = self.to_dict()
+        values["design_color"] = str(self.design_color)
+        values["highlight_colors"] = tuple(
+            str(color) for color in self.highlight_colors
+        )
+        return tuple(values.values())
+
+    def __eq__(self, other):
+        return isinstance(other, Settings) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        values = ", ".join(
+            f"{name}={value!r}" for name, value in self.to_dict().items()
+        )
+        return f"Settings({values})"
+
+
 class Design:
     """Holds pattern group(s)"""
 
@@ -51,41 +206,315 @@ class Design:
 
         self.design_group = Group()
         self.pattern_groups = []
-
-    def elements(self):
-        """get element selection (no selection returns all elements)"""
+        self.design_elements = []
+        self.element_bboxes = np.empty((0, 4))
+        # composed transforms of the design elements (the elements are only changed
+        # if they are moved into the pattern groups, see keep_design)
+        self.transforms = []
+        self.element_digests = []
+        self._element_groups = None
+        # composed transforms and skipped element counts of the element collector
+        self.composed_transforms = {}
+        self.skipped = {}
+        self.scale_factor = None
+        self._bbox = None
+        self._geometry = None
+
+    def elements(self, exclude=(), include=()):
+        """get element selection (no selection returns all rendered elements)
+        elements within the excluded containers are skipped, elements within the
+        included containers are collected even if they are not rendered (defs)"""
+        collector = ElementCollector(exclude, include)
         if not self.svg.selection:
-            pattern_elements = self.svg.xpath(
-                ".//svg:rect|.//svg:circle|.//svg:ellipse|.//svg:path"
-            )
-            pattern_elements = list(pattern_elements)
+            collector.collect(self.svg)
         else:
-            pattern_elements = self.svg.selection.rendering_order()
-            pattern_elements = list(
-                pattern_elements.get((PathElement, Ellipse, Rectangle, Circle))
-            )
+            for element in self.svg.selection.rendering_order():
+                collector.collect(element)
+        self.composed_transforms = collector.transforms
+        self.skipped = collector.skipped
+        pattern_elements = collector.elements
         pattern_elements.reverse()
         return pattern_elements
 
-    def elements_to_pattern_groups(self):
+    def elements_to_pattern_groups(self, elements=None):
         """Generates pattern groups, one group for each color of the original pattern
         If keep_pattern_color is set to False, all elements are grouped together and use
         the pattern color setting.
         """
-        elements = self.elements()
-        if not self.settings["keep_pattern_color"]:
-            pattern_group = self.new_pattern_group(self.settings["design_color"])
-            pattern_group.add_elements(elements)
+        if elements is None:
+            elements = self.elements()
+        self.design_elements = elements
+        self.transforms = [None] * len(elements)
+        self.element_bboxes = np.full((len(elements), 4), np.nan)
+        if not self.settings.keep_pattern_color:
+            self.new_pattern_group(self.settings.design_color)
+            for index, element in enumerate(elements):
+                if self._prepare_element(index, element):
+                    self._insert_element(0, index)
+            self._bbox = self._union_bbox()
             return
-        previous_color = None
-        pattern_group = None
-        for element in elements:
+        # elements are ordered from top to bottom: an element can join the last group
+        # of its color, unless it overlaps an element of a group in between (the
+        # element would be moved above it)
+        color_groups = {}
+        bboxes = self.element_bboxes
+        element_groups = np.full(len(elements), -1)
+        for index, element in enumerate(elements):
+            if not self._prepare_element(index, element):
+                continue
+            left, right, top, bottom = bboxes[index].tolist()
             color = element.style("fill", "black")
-            if pattern_group and previous_color == color:
-                pattern_group.add_element(element)
+            group = color_groups.get(color)
+            if group is not None:
+                others = bboxes[:index][element_groups[:index] > group]
+                if np.any(
+                    (others[:, 0] < right)
+                    & (left < others[:, 1])
+                    & (others[:, 2] < bottom)
+                    & (top < others[:, 3])
+                ):
+                    group = None
+            if group is None:
+                self.new_pattern_group(color)
+                group = len(self.pattern_groups) - 1
+                color_groups[color] = group
+            self._insert_element(group, index)
+            element_groups[index] = group
+        self._bbox = self._union_bbox()
+
+    def _prepare_element(self, index, element):
+        """applies the transforms and measures an element
+        returns False for elements which can't be part of the pattern"""
+        transform = self.composed_transforms.get(element)
+        if transform is None:
+            transform = element.composed_transform()
+        self.transforms[index] = transform
+        if not self.settings.keep_design:
+            element.transform = transform
+        # exclude cliped paths (they won't work)
+        if element.get("clip-path", None) is not None:
+            return False
+        if self.settings.keep_design:
+            parent = self.parent_transform(element, transform)
+            if parent is None:
+                return False
+            bbox = element.bounding_box(parent)
+        else:
+            bbox = element.bounding_box()
+        if bbox is not None:
+            self.element_bboxes[index] = (bbox.left, bbox.right, bbox.top, bbox.bottom)
+        return True
+
+    def _insert_element(self, group, index):
+        """inserts the design element into the pattern group: the element itself (with
+        the composed transform) or a reference to the element in place (keep_design)"""
+        element = self.design_elements[index]
+        if self.settings.keep_design:
+            transform = self.parent_transform(element, self.transforms[index])
+            self.pattern_groups[group].insert_reference(element, transform, index)
+        else:
+            self.pattern_groups[group].insert_element(element, index)
+
+    @staticmethod
+    def parent_transform(element, transform):
+        """returns the composed transform of the parent of an element with the composed
+        transform (None if it can't be computed, the element isn't rendered anyway)"""
+        if element.get("transform") is None:
+            return transform
+        if transform.a * transform.d - transform.b * transform.c == 0:
+            return None
+        own = element.transform
+        if own.a * own.d - own.b * own.c == 0:
+            return None
+        return transform @ -own
+
+    def _union_bbox(self):
+        """returns the union of the element bounding boxes (the design bounding box)"""
+        measured = self.element_bboxes[~np.isnan(self.element_bboxes[:, 0])]
+        if len(measured) == 0:
+            return None
+        left, top = measured[:, [0, 2]].min(axis=0).tolist()
+        right, bottom = measured[:, [1, 3]].max(axis=0).tolist()
+        return BoundingBox((left, right), (top, bottom))
+
+    def fingerprint(self, elements):
+        """returns a hash of everything the pattern groups and the geometry depend on:
+        the elements with their ancestors (transforms and styles) and the color settings
+        """
+        digest = hashlib.sha256(
+            f"{GeometryCache.VERSION};{self.tolerances()};"
+            f"{self.settings.keep_pattern_color};{self.settings.design_color};"
+            "".join(str(sheet) for sheet in self.svg.stylesheets).encode()
+        )
+        ancestors = {}
+
+        def ancestor_key(parent):
+            if parent is None:
+                return b""
+            if parent not in ancestors:
+                ancestors[parent] = hashlib.sha256(
+                    ancestor_key(parent.getparent())
+                    + f"{parent.get('transform')};{parent.get('style')}".encode()
+                ).digest()
+            return ancestors[parent]
+
+        for element in elements:
+            digest.update(ancestor_key(element.getparent()))
+            digest.update(element.tostring())
+        return digest.hexdigest()
+
+    def page_key(self, settings_key, page_index, left, right):
+        """returns a hash of everything a page depends on: the settings and the
+        elements (with their pattern group) within the x range of the page"""
+        if not self.element_digests:
+            # elements with composed transforms: the hash doesn't depend on the
+            # position of the element in the document
+            self.element_digests = [
+                hashlib.sha256(
+                    element.tostring() + str(transform.to_hexad()).encode()
+                ).digest()
+                for element, transform in zip(self.design_elements, self.transforms)
+            ]
+            self._element_groups = self.element_groups()
+        digest = hashlib.sha256(f"{settings_key};{page_index}".encode())
+        scale_factor = self.scale_factor or 1
+        visible = (self.element_bboxes[:, 0] * scale_factor <= right) & (
+            self.element_bboxes[:, 1] * scale_factor >= left
+        )
+        for index in np.flatnonzero(visible).tolist():
+            group = self._element_groups[index]
+            digest.update(self.element_digests[index] + b"%d" % group)
+        return digest.hexdigest()
+
+    def cache_entry(self):
+        """returns the composed transforms, pattern groups, bounding boxes and geometry
+        of the design elements as arrays"""
+        transforms = [transform.to_hexad() for transform in self.transforms]
+        bbox = self.bbox() if self.scale_factor is None else self._bbox
+        entry = {
+            "transforms": np.array(transforms, dtype=float).reshape(-1, 6),
+            "groups": self.element_groups(),
+            "colors": np.array([str(color) for color in self.colors]),
+            "bbox": np.array([bbox.left, bbox.right, bbox.top, bbox.bottom]),
+            "element_bboxes": self.element_bboxes,
+        }
+        entry.update(self.geometry.to_arrays())
+        return entry
+
+    def restore(self, elements, entry):
+        """rebuilds the pattern groups from a cache entry instead of composing
+        transforms and measuring the design"""
+        self.design_elements = elements
+        self.transforms = [
+            Transform(tuple(hexad)) for hexad in entry["transforms"].tolist()
+        ]
+        if not self.settings.keep_design:
+            for element, transform in zip(elements, self.transforms):
+                element.transform = transform
+        for color in entry["colors"].tolist():
+            self.new_pattern_group(color)
+        for index, group in enumerate(entry["groups"].tolist()):
+            if group >= 0:
+                self._insert_element(group, index)
+        left, right, top, bottom = entry["bbox"].tolist()
+        self._bbox = BoundingBox((left, right), (top, bottom))
+        self.element_bboxes = entry["element_bboxes"]
+        self._geometry = DesignGeometry.from_arrays(entry)
+
+    def element_groups(self):
+        """returns the pattern group index of each element (-1 for excluded elements)"""
+        groups = np.full(len(self.design_elements), -1)
+        for i, pattern in enumerate(self.pattern_groups):
+            groups[pattern.indices] = i
+        return groups
+
+    def tolerances(self):
+        """returns the flattening and the simplification tolerance of the geometry"""
+        return (
+            self.settings.flatness or DesignGeometry.FLATNESS,
+            self.settings.simplify or 0,
+        )
+
+    @property
+    def geometry(self):
+        """returns the flattened (unscaled) geometry of the pattern group elements,
+        it is only computed once"""
+        if self._geometry is None:
+            self._geometry = DesignGeometry.from_elements(
+                self.design_elements,
+                self.element_groups() >= 0,
+                *self.tolerances(),
+                transforms=self.transforms,
+            )
+        return self._geometry
+
+    def scanline_clip(self, pattern_groups=None):
+        """returns a scanline clip of the scaled pattern groups (default: all)"""
+        if pattern_groups is None:
+            pattern_groups = self.pattern_groups
+        indices = [index for pattern in pattern_groups for index in pattern.indices]
+        return self.geometry.scanline_clip(indices, self.scale_factor)
+
+    def raster_clips(self, pixel_size, time_budget=None):
+        """returns a raster clip of each scaled pattern group and the number of skipped
+        elements: the elements are flattened with the pixel size as tolerance and
+        rasterized from the largest to the smallest until the time budget (seconds)
+        is used up"""
+        bbox = self.bbox()
+        if bbox is None:
+            return [], 0
+        deadline = None
+        if time_budget is not None:
+            deadline = time.perf_counter() + time_budget
+        clips = [
+            RasterClip(bbox, self.settings.line_distance, pixel_size)
+            for _ in self.pattern_groups
+        ]
+        groups = self.element_groups()
+        bboxes = np.nan_to_num(self.element_bboxes)
+        areas = (bboxes[:, 1] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 2])
+        order = [
+            index
+            for index in np.argsort(-areas, kind="stable").tolist()
+            if groups[index] >= 0
+        ]
+        scale = [self.scale_factor or 1, 1]
+        for done, index in enumerate(order):
+            if deadline is not None and time.perf_counter() > deadline:
+                return clips, len(order) - done
+            element = self.design_elements[index]
+            if self._geometry is not None:
+                polygons = self._geometry.polygons(index)
             else:
-                pattern_group = self.new_pattern_group(color)
-                pattern_group.add_element(element)
+                polygons = DesignGeometry.element_polygons(
+                    element, pixel_size / 2, transform=self.transforms[index]
+                )
+            evenodd = element.style.get("clip-rule", "nonzero") == "evenodd"
+            clips[groups[index]].fill(
+                [polygon * scale for polygon in polygons], evenodd
+            )
+        return clips, 0
+
+    def page_clip(self, pattern):
+        """returns a clip which is cropped to each page for a scaled pattern group"""
+        geometry = self.geometry
+        scale = [self.scale_factor or 1, 1]
+        polygons = []
+        offsets = [0]
+        for index in pattern.indices:
+            evenodd = bool(geometry.evenodd[index])
+            for polygon in geometry.polygons(index):
+                polygons.append((polygon * scale, evenodd))
+            offsets.append(len(polygons))
+        # x extent of the polygons (in pattern order)
+        bboxes = geometry.polygon_bboxes()
+        selected = [
+            np.arange(*geometry.element_offsets[index : index + 2].tolist())
+            for index in pattern.indices
+        ]
+        selected = np.concatenate(selected) if selected else np.empty(0, dtype=int)
+        x_range = bboxes[selected][:, :2] * scale[0]
+        return PageClip(self.svg, polygons, x_range, offsets)
 
     def new_pattern_group(self, color):
         """adds a new pattern group"""
@@ -98,9 +527,31 @@ class Design:
         for group in self.pattern_groups:
             self.design_group.insert(0, group.pattern)
 
+    def group_to_defs(self, group=None):
+        """inserts the design group into the defs
+        an existing group can be passed to replace its content
+        returns the group"""
+        if group is None:
+            self.svg.defs.add(self.design_group)
+            return self.design_group
+        for child in list(group):
+            group.remove(child)
+        for child in list(self.design_group):
+            group.append(child)
+        self.design_group = group
+        return group
+
     def bbox(self):
-        """returns the bounding box of the entire design"""
-        return self.design_group.bounding_box()
+        """returns the bounding box of the entire design
+        it is only computed once, the scaled bounding box is derived from it"""
+        if self._bbox is None:
+            self._bbox = self.design_group.bounding_box()
+        if self.scale_factor is None:
+            return self._bbox
+        return BoundingBox(
+            (self._bbox.left * self.scale_factor, self._bbox.right * self.scale_factor),
+            self._bbox.y,
+        )
 
     @property
     def colors(self):
@@ -112,14 +563,15 @@ class Design:
 
     def scale(self):
         """scale the design according to the line distance setting"""
-        num_pages = self.settings["design_pages"]
+        num_pages = self.settings.design_pages
         width = self.bbox().width
         if num_pages <= 0 or width == 0:
             return
 
-        scale_factor = self.settings["line_distance"] / (width / num_pages)
+        scale_factor = self.settings.line_distance / (width / num_pages)
         for pattern in self.pattern_groups:
             pattern.scale(scale_factor)
+        self.scale_factor = scale_factor
 
     def __len__(self):
         return len(self.pattern_groups)
@@ -128,6 +580,87 @@ class Design:
         return f"Design({self.pattern_groups})"
 
 
+class ElementCollector:
+    """Collects the design elements in a single pass through the document
+
+    Subtrees which are not rendered (defs, markers, ...), hidden (display:none) or
+    excluded (previous output) are skipped. The composed transforms are computed on
+    the way down the tree.
+    """
+
+    SHAPES = {addNS(tag, "svg") for tag in ("path", "rect", "circle", "ellipse")}
+    CONTAINERS = {addNS(tag, "svg") for tag in ("svg", "g", "a", "switch")}
+
+    def __init__(self, exclude=(), include=()):
+        """include: containers which are not rendered (clip paths or groups in the
+        defs), but hold design elements"""
+        self.exclude = set(exclude)
+        self.include = set(include)
+        # ancestors of the included containers, they are entered to reach them
+        self.passage = {
+            ancestor for container in include for ancestor in container.iterancestors()
+        }
+        self.elements = []
+        self.transforms = {}
+        self.skipped = {"not_rendered": 0, "hidden": 0, "previous_output": 0}
+
+    def collect(self, element):
+        """collects the shapes of the element and its descendants (document order)"""
+        if not self.exclude.isdisjoint(element.iterancestors()):
+            self._skip("previous_output", element)
+            return self.elements
+        parent = element.getparent()
+        transform = Transform() if parent is None else parent.composed_transform()
+        self._visit(element, transform, True, True)
+        return self.elements
+
+    def _visit(self, element, transform, visible, rendered):
+        # pylint: disable=too-many-arguments
+        if element in self.exclude:
+            self._skip("previous_output", element)
+            return
+        if element in self.include:
+            rendered = True
+        elif element.tag not in self.SHAPES and element.tag not in self.CONTAINERS:
+            rendered = False
+        if not rendered and element not in self.passage:
+            self._skip("not_rendered", element)
+            return
+        if self._style(element, "display") == "none":
+            self._skip("hidden", element)
+            return
+        visibility = self._style(element, "visibility")
+        if visibility is not None:
+            visible = visibility not in ("hidden", "collapse")
+        if element.get("transform") is not None:
+            transform = transform @ element.transform
+
+        if element.tag in self.SHAPES:
+            if not visible:
+                self.skipped["hidden"] += 1
+            elif element not in self.transforms:
+                self.elements.append(element)
+                self.transforms[element] = transform
+            return
+        for child in element:
+            # skip comments and processing instructions
+            if isinstance(child.tag, str):
+                self._visit(child, transform, visible, rendered)
+
+    def _skip(self, reason, element):
+        """counts the shapes within a skipped subtree"""
+        self.skipped[reason] += sum(1 for _ in element.iter(*self.SHAPES))
+
+    @staticmethod
+    def _style(element, name):
+        """returns the value of a style property set on the element (or None)"""
+        value = element.get(name)
+        style = element.get("style")
+        if style and name in style:
+            value = Style(style).get(name, value)
+        return value
+
+
 class PatternGroup:
     """Holds design elements of the same color"""
 
@@ -135,36 +668,575 @@ class PatternGroup:
         self.svg = svg
         self.color = color
         self.pattern = Group()
-
-    def add_element(self, element):
-        """apply transforms and adds an element to the pattern group"""
-        element.transform = element.composed_transform()
-        # exclude cliped paths (they won't work)
-        if element.get("clip-path", None) is None:
-            self.pattern.insert(0, element)
-
-    def add_elements(self, elements):
-        """adds multiple elements to the pattern group"""
-        for element in elements:
-            self.add_element(element)
+        # positions of the pattern elements in the design element list
+        self.indices = []
+
+    def insert_element(self, element, index=None):
+        """inserts an element with already composed transforms"""
+        self.pattern.insert(0, element)
+        if index is not None:
+            self.indices.append(index)
+
+    def insert_reference(self, element, transform, index=None):
+        """inserts a reference (use) to an element which stays in place, the transform
+        is the composed transform of its parent"""
+        use = Use()
+        use.href = element
+        if transform:
+            use.transform = transform
+        self.pattern.insert(0, use)
+        if index is not None:
+            self.indices.append(index)
 
     def scale(self, scale_factor):
         """scales the pattern in x direction to stretch it according to the line distance value
         the pattern group will not be distorted in y direction"""
         self.pattern.transform = Transform(f"scale({scale_factor}, 1)")
 
-    def to_clip_path(self):
+    def to_clip_path(self, clip=None):
         """generates a clip path which contains the pattern group and inserts it into the svg
+        an existing clip path can be passed to replace its content
         returns the clip element"""
-        clip = ClipPath()
+        if clip is None:
+            clip = ClipPath()
+            # the clips of lower pattern groups come first (like in the design group),
+            # so that the design keeps its stacking order on the next run
+            self.svg.defs.insert(0, clip)
+        for child in list(clip):
+            clip.remove(child)
         clip.insert(0, self.pattern)
-        self.svg.defs.add(clip)
         return clip
 
     def __repr__(self):
         return f"PatternGroup({self.color}, {self.pattern})"
 
 
+class DesignGeometry:
+    """Flattened outlines of the design elements in document coordinates (unscaled)
+
+    The points of all polygons are stored in one array. polygon_offsets marks where
+    each polygon starts, element_offsets which polygons belong to each element.
+    Curves are flattened to the flatness tolerance, the polygons are simplified with
+    the Douglas-Peucker algorithm (simplify tolerance, 0: not simplified).
+    """
+
+    FLATNESS = 0.01
+
+    def __init__(self, points, polygon_offsets, element_offsets, evenodd):
+        self.points = points
+        self.polygon_offsets = polygon_offsets
+        self.element_offsets = element_offsets
+        self.evenodd = evenodd
+
+    @classmethod
+    def from_elements(
+        cls, elements, include=None, flatness=None, simplify=0, transforms=None
+    ):  # pylint: disable=too-many-arguments
+        """flattens the (transformed) elements, elements which are not included
+        get no polygons, transforms replace the transforms of the elements"""
+        polygons = []
+        polygon_offsets = [0]
+        element_offsets = [0]
+        evenodd = []
+        for i, element in enumerate(elements):
+            evenodd.append(element.style.get("clip-rule", "nonzero") == "evenodd")
+            if include is None or include[i]:
+                transform = None if transforms is None else transforms[i]
+                for polygon in cls.element_polygons(
+                    element, flatness, simplify, transform
+                ):
+                    polygons.append(polygon)
+                    polygon_offsets.append(polygon_offsets[-1] + len(polygon))
+            element_offsets.append(len(polygons))
+        return cls(
+            np.vstack(polygons) if polygons else np.empty((0, 2)),
+            np.array(polygon_offsets),
+            np.array(element_offsets),
+            np.array(evenodd, dtype=bool),
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """restores the geometry from the output of to_arrays()"""
+        return cls(
+            arrays["points"],
+            arrays["polygon_offsets"],
+            arrays["element_offsets"],
+            arrays["evenodd"],
+        )
+
+    def to_arrays(self):
+        """returns the geometry as a dictionary of arrays"""
+        return {
+            "points": self.points,
+            "polygon_offsets": self.polygon_offsets,
+            "element_offsets": self.element_offsets,
+            "evenodd": self.evenodd,
+        }
+
+    @classmethod
+    def element_polygons(cls, element, flatness=None, simplify=0, transform=None):
+        """returns the polygons of a (transformed) element, they are memoized for
+        elements with the same path, transform and tolerances
+        the transform replaces the transform of the element"""
+        if isinstance(element, PathElement):
+            path = element.get("d", "")
+        else:
+            path = str(element.path)
+        if transform is None:
+            transform = element.transform
+        return _element_polygons(
+            path, transform.to_hexad(), flatness or cls.FLATNESS, simplify
+        )
+
+    @classmethod
+    def _flatten(cls, path, flatness=None, simplify=0):
+        """converts a path into a list of closed polygons (arrays of points)"""
+        polygons = []
+        for points in cls._sample_curves(path.to_superpath(), flatness or cls.FLATNESS):
+            if simplify > 0:
+                points = cls._simplify(points, simplify)
+            if len(points) > 2:
+                polygons.append(points)
+        return polygons
+
+    @staticmethod
+    def _sample_curves(csp, flatness):
+        """returns the points of each subpath, all Bézier segments of the path are
+        sampled at once at equal parameter steps"""
+        segments = []
+        counts = []
+        for subpath in csp:
+            for previous, node in zip(subpath, subpath[1:]):
+                segments.append((previous[1], previous[2], node[0], node[1]))
+            # the end point of the subpath as degenerated segment
+            segments.append((subpath[-1][1],) * 4)
+            counts.append(len(subpath))
+        if not segments:
+            return []
+        start, control1, control2, end = np.array(segments, dtype=float).transpose(
+            1, 0, 2
+        )
+        # Wang's formula: steps for a maximum distance of flatness to the curve
+        second_differences = np.maximum(
+            np.hypot(*(start - 2 * control1 + control2).T),
+            np.hypot(*(control1 - 2 * control2 + end).T),
+        )
+        steps = np.ceil(np.sqrt(0.75 * second_differences / flatness))
+        # like cspsubdiv: segments with the control points close to the chord are
+        # flat (lines are not subdivided)
+        delta_x, delta_y = (end - start).T
+        length = np.hypot(delta_x, delta_y)
+        distances = np.zeros(len(start))
+        for control in (control1 - start, control2 - start):
+            distance = np.where(
+                length > 0,
+                np.abs(delta_x * control[:, 1] - delta_y * control[:, 0])
+                / np.where(length > 0, length, 1),
+                np.hypot(*control.T),
+            )
+            distances = np.maximum(distances, distance)
+        steps[distances <= flatness] = 1
+        steps = np.maximum(steps, 1).astype(int)
+        segment = np.repeat(np.arange(len(steps)), steps)
+        first = np.cumsum(steps) - steps
+        t = ((np.arange(len(segment)) - first[segment]) / steps[segment])[:, None]
+        s = 1 - t
+        points = (
+            s**3 * start[segment]
+            + 3 * s**2 * t * control1[segment]
+            + 3 * s * t**2 * control2[segment]
+            + t**3 * end[segment]
+        )
+        return np.split(points, np.cumsum(steps)[np.cumsum(counts)[:-1] - 1])
+
+    @staticmethod
+    def _simplify(points, tolerance):
+        """simplifies a closed polygon with the Douglas-Peucker algorithm"""
+        if len(points) < 4:
+            return points
+        # split the ring at the point farthest from the first point
+        far = int(np.argmax(((points - points[0]) ** 2).sum(axis=1)))
+        ring = np.vstack((points, points[:1]))
+        keep = np.zeros(len(ring), dtype=bool)
+        keep[[0, far, -1]] = True
+        stack = [(0, far), (far, len(points))]
+        while stack:
+            first, last = stack.pop()
+            if last - first < 2:
+                continue
+            start = ring[first]
+            delta_x, delta_y = ring[last] - start
+            offsets = ring[first + 1 : last] - start
+            length = np.hypot(delta_x, delta_y)
+            if length == 0:
+                distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            else:
+                distances = (
+                    np.abs(delta_x * offsets[:, 1] - delta_y * offsets[:, 0]) / length
+                )
+            index = int(np.argmax(distances))
+            if distances[index] > tolerance:
+                middle = first + 1 + index
+                keep[middle] = True
+                stack.extend(((first, middle), (middle, last)))
+        return ring[:-1][keep[:-1]]
+
+    def polygon_bboxes(self):
+        """returns the bounding box (left, right, top, bottom) of each polygon"""
+        starts = self.polygon_offsets[:-1]
+        if len(starts) == 0:
+            return np.empty((0, 4))
+        x_values = self.points[:, 0]
+        y_values = self.points[:, 1]
+        return np.column_stack(
+            (
+                np.minimum.reduceat(x_values, starts),
+                np.maximum.reduceat(x_values, starts),
+                np.minimum.reduceat(y_values, starts),
+                np.maximum.reduceat(y_values, starts),
+            )
+        )
+
+    def element_bboxes(self):
+        """returns the bounding box (left, right, top, bottom) of the polygons of each
+        element (NaN for elements without polygons)"""
+        polygon_bboxes = self.polygon_bboxes()
+        bboxes = np.full((len(self.element_offsets) - 1, 4), np.nan)
+        counts = np.diff(self.element_offsets)
+        has_polygons = counts > 0
+        starts = self.element_offsets[:-1][has_polygons]
+        if len(starts):
+            bboxes[has_polygons, 0] = np.minimum.reduceat(polygon_bboxes[:, 0], starts)
+            bboxes[has_polygons, 1] = np.maximum.reduceat(polygon_bboxes[:, 1], starts)
+            bboxes[has_polygons, 2] = np.minimum.reduceat(polygon_bboxes[:, 2], starts)
+            bboxes[has_polygons, 3] = np.maximum.reduceat(polygon_bboxes[:, 3], starts)
+        return bboxes
+
+    def polygons(self, index):
+        """returns the polygons of the element at the given index"""
+        first, last = self.element_offsets[index : index + 2].tolist()
+        offsets = self.polygon_offsets[first : last + 1].tolist()
+        return [self.points[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def scanline_clip(self, element_indices, scale_factor=None):
+        """returns a scanline clip of the given elements,
+        stretched in x direction by the scale factor"""
+        edges = []
+        for shape, index in enumerate(element_indices):
+            for polygon in self.polygons(index):
+                end = np.roll(polygon, -1, axis=0)
+                shape_column = np.full((len(polygon), 1), shape)
+                edges.append(np.hstack((polygon, end, shape_column)))
+        edges = np.vstack(edges) if edges else np.empty((0, 5))
+        if scale_factor is not None:
+            edges[:, [0, 2]] *= scale_factor
+        return ScanlineClip(edges, self.evenodd[list(element_indices)])
+
+
+@lru_cache(maxsize=4096)
+def _element_polygons(path, hexad, flatness, simplify):
+    """returns the flattened polygons of the path data with the transform (hexad),
+    the arrays are read only, they are shared between all callers"""
+    path = Path(path).transform(Transform(hexad))
+    polygons = DesignGeometry._flatten(path, flatness, simplify)
+    for polygon in polygons:
+        polygon.flags.writeable = False
+    return tuple(polygons)
+
+
+class ScanlineClip:
+    """Polygon edges of pattern groups, intersected analytically with vertical lines
+
+    This is an alternative to clip paths: instead of clipping full height lines when
+    the document is rendered, only the visible parts of each line are generated.
+    """
+
+    def __init__(self, edges, evenodd):
+        """edges: array with one row (x start, y start, x end, y end, shape) per edge
+        evenodd: the fill rule of each shape"""
+        # vertical edges never cross a vertical line
+        edges = edges[edges[:, 0] != edges[:, 2]]
+        # edge table: edges sorted by their left end
+        edges = edges[np.argsort(np.minimum(edges[:, 0], edges[:, 2]), kind="stable")]
+        self.x_start, self.y_start, self.x_end, self.y_end = edges[:, :4].T
+        self.left = np.minimum(self.x_start, self.x_end)
+        self.right = np.maximum(self.x_start, self.x_end)
+        self.shape = edges[:, 4].astype(int)
+        self.evenodd = np.asarray(evenodd, dtype=bool)
+
+    def scan(self, x_positions, top, bottom, min_gap=0):
+        """returns the visible (top, bottom) intervals for each of the (ascending)
+        x positions, intervals closer than min_gap are merged"""
+        x_positions = np.asarray(x_positions, dtype=float)
+        num_lines = len(x_positions)
+
+        # sweep: an edge crosses all lines with left <= x < right,
+        # which is a consecutive range of the sorted x positions
+        first = np.searchsorted(x_positions, self.left, "left")
+        counts = np.searchsorted(x_positions, self.right, "left") - first
+        edge = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+        line = np.repeat(first, counts) + offsets
+
+        x_start = self.x_start[edge]
+        y_start = self.y_start[edge]
+        delta_x = self.x_end[edge] - x_start
+        delta_y = self.y_end[edge] - y_start
+        y_cross = y_start + (x_positions[line] - x_start) * delta_y / delta_x
+        direction = np.sign(delta_x)
+        shape = self.shape[edge]
+
+        order = np.lexsort((y_cross, shape, line))
+        y_cross = y_cross[order]
+        direction = direction[order]
+        shape = shape[order]
+        line = line[order]
+
+        # winding number (nonzero) or crossing count (evenodd) within each shape
+        new_group = np.ones(len(line), dtype=bool)
+        new_group[1:] = (line[1:] != line[:-1]) | (shape[1:] != shape[:-1])
+        group_start = np.flatnonzero(new_group)
+        counts = np.diff(np.append(group_start, len(line)))
+        winding = np.cumsum(direction)
+        winding -= np.repeat(winding[group_start] - direction[group_start], counts)
+        crossings = np.arange(len(line)) - np.repeat(group_start, counts) + 1
+        inside = np.where(self.evenodd[shape], crossings % 2 == 1, winding != 0)
+        inside[:-1] &= ~new_group[1:]
+        if len(inside):
+            inside[-1] = False
+
+        starts = y_cross[inside]
+        ends = y_cross[np.flatnonzero(inside) + 1]
+        line, starts, ends = self._union(line[inside], starts, ends, min_gap)
+        return self._intervals(num_lines, line, starts, ends, top, bottom)
+
+    @staticmethod
+    def _intervals(num_lines, line, starts, ends, top, bottom):
+        """returns the intervals of each line, limited to top and bottom"""
+        starts = np.maximum(starts, top)
+        ends = np.minimum(ends, bottom)
+        visible = starts < ends
+        intervals = [[] for _ in range(num_lines)]
+        for line_index, start, end in zip(
+            line[visible].tolist(), starts[visible].tolist(), ends[visible].tolist()
+        ):
+            intervals[line_index].append((start, end))
+        return intervals
+
+    @staticmethod
+    def _union(line, starts, ends, min_gap):
+        """merges overlapping intervals of each line
+        returns line indices, starts and ends of the merged intervals"""
+        if len(starts) == 0:
+            return line, starts, ends
+
+        order = np.lexsort((starts, line))
+        line = line[order]
+        starts = starts[order]
+        ends = ends[order]
+
+        # running maximum of the interval ends within each line: rank the values,
+        # so that each line can be shifted above the previous one without rounding
+        values, ranks = np.unique(
+            np.concatenate((starts, ends + min_gap)), return_inverse=True
+        )
+        shift = line * (len(values) + 1)
+        start_ranks = ranks[: len(starts)] + shift
+        end_ranks = np.maximum.accumulate(ranks[len(starts) :] + shift)
+        new_interval = np.ones(len(starts), dtype=bool)
+        new_interval[1:] = start_ranks[1:] > end_ranks[:-1]
+
+        first = np.flatnonzero(new_interval)
+        return line[first], starts[first], np.maximum.reduceat(ends, first)
+
+
+class RasterClip:
+    """Pattern group rasterized into a bitmap with one column per line (book page)
+
+    A fast, low detail alternative to the scanline clip for previews of huge designs:
+    a pixel is filled if its center is inside the shape, so the cost depends on the
+    number of pixels rather than on the number of curves.
+    """
+
+    def __init__(self, bbox, column_width, pixel_size):
+        """bbox: scaled design bounding box, the columns are placed at
+        bbox.left + k * column_width (the x positions of the lines)"""
+        self.x_origin = bbox.left
+        self.column_width = column_width
+        self.top = bbox.top
+        self.pixel_size = pixel_size
+        num_columns = int(ceil(bbox.width / column_width)) + 1
+        num_rows = int(ceil(bbox.height / pixel_size)) + 1
+        self.bitmap = np.zeros((num_rows, num_columns), dtype=bool)
+
+    def fill(self, polygons, evenodd=False):
+        """rasterizes a shape (list of closed polygons in scaled coordinates)"""
+        if not polygons:
+            return
+        num_rows, num_columns = self.bitmap.shape
+        points = np.vstack(polygons)
+        ends = np.vstack([np.roll(polygon, -1, axis=0) for polygon in polygons])
+        # pixel coordinates: columns and pixel centers are at integer values
+        x_start = (points[:, 0] - self.x_origin) / self.column_width
+        x_end = (ends[:, 0] - self.x_origin) / self.column_width
+        y_start = (points[:, 1] - self.top) / self.pixel_size - 0.5
+        y_end = (ends[:, 1] - self.top) / self.pixel_size - 0.5
+
+        # an edge crosses all columns with left <= column < right
+        first = np.clip(np.ceil(np.minimum(x_start, x_end)), 0, num_columns)
+        last = np.clip(np.ceil(np.maximum(x_start, x_end)), 0, num_columns)
+        counts = (last - first).astype(int)
+        if counts.sum() == 0:
+            return
+        edge = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+        column = np.repeat(first.astype(int), counts) + offsets
+
+        delta_x = x_end[edge] - x_start[edge]
+        y_cross = (
+            y_start[edge]
+            + (column - x_start[edge]) * (y_end[edge] - y_start[edge]) / delta_x
+        )
+        # the first pixel center below the crossing toggles the winding
+        row = np.clip(np.ceil(y_cross), 0, num_rows).astype(int)
+        weight = np.ones(len(edge), dtype=int)
+        if not evenodd:
+            weight = np.sign(delta_x).astype(int)
+
+        left = int(column.min())
+        right = int(column.max()) + 1
+        winding = np.zeros((num_rows + 1, right - left), dtype=int)
+        np.add.at(winding, (row, column - left), weight)
+        winding = np.cumsum(winding, axis=0)[:-1]
+        inside = winding % 2 == 1 if evenodd else winding != 0
+        self.bitmap[:, left:right] |= inside
+
+    def union(self, others):
+        """returns a copy with the filled pixels of other raster clips of the same
+        design added"""
+        clip = copy.copy(self)
+        clip.bitmap = np.logical_or.reduce([self.bitmap] + [c.bitmap for c in others])
+        return clip
+
+    def scan(self, x_positions, top, bottom, min_gap=0):
+        """returns the filled (top, bottom) intervals of the nearest column for each of
+        the x positions, intervals closer than min_gap are merged"""
+        x_positions = np.asarray(x_positions, dtype=float)
+        columns = np.rint((x_positions - self.x_origin) / self.column_width)
+        columns = columns.astype(int)
+        valid = (columns >= 0) & (columns < self.bitmap.shape[1])
+        samples = np.zeros((len(columns), self.bitmap.shape[0] + 2), dtype=np.int8)
+        samples[valid, 1:-1] = self.bitmap[:, columns[valid]].T
+        changes = np.diff(samples, axis=1)
+        # runs of filled pixels, in line order
+        line, start_rows = np.nonzero(changes == 1)
+        end_rows = np.nonzero(changes == -1)[1]
+        starts = self.top + start_rows * self.pixel_size
+        ends = self.top + end_rows * self.pixel_size
+        if min_gap:
+            line, starts, ends = ScanlineClip._union(line, starts, ends, min_gap)
+        return ScanlineClip._intervals(len(columns), line, starts, ends, top, bottom)
+
+    def count_cuts(self, x_positions, top, bottom):
+        """returns the estimated number of cuts (two per fold zone) of the lines"""
+        intervals = self.scan(x_positions, top, bottom)
+        return 2 * sum(len(line_intervals) for line_intervals in intervals)
+
+
+class PageClip:
+    """Builds clip paths which only contain the part of a pattern group within the
+    x range of one page, so that the clip complexity of a page depends on the local
+    design complexity only
+
+    The flattened polygons are cropped with the Sutherland-Hodgman algorithm. The
+    cropped polygons of one element are joined into one path, so that its fill rule
+    still applies to all of them (holes stay holes).
+    """
+
+    def __init__(self, svg, polygons, x_range=None, offsets=None):
+        """polygons: list of (points, evenodd) in scaled design coordinates
+        x_range: array with the (left, right) extent of each polygon
+        offsets: where the polygons of each element start (default: one polygon
+        per element)"""
+        self.svg = svg
+        self.polygons = polygons
+        if offsets is None:
+            offsets = range(len(polygons) + 1)
+        self.offsets = np.asarray(offsets, dtype=int)
+        if x_range is None:
+            x_range = [
+                (points[:, 0].min(), points[:, 0].max()) for points, _ in polygons
+            ]
+        x_range = np.asarray(x_range, dtype=float).reshape(-1, 2)
+        self.left = x_range[:, 0]
+        self.right = x_range[:, 1]
+
+    def __getstate__(self):
+        # worker processes only crop the polygons, the svg stays in the main process
+        return dict(self.__dict__, svg=None)
+
+    def crop(self, left, right):
+        """generates a clip path with the polygons cropped to left <= x <= right
+        and inserts it into the svg, returns the clip element"""
+        return self.to_clip(self.crop_paths(left, right))
+
+    def crop_paths(self, left, right):
+        """returns the path data and fill rule of each element with its polygons
+        cropped to left <= x <= right"""
+        rings = {}
+        visible = np.flatnonzero((self.left <= right) & (self.right >= left))
+        elements = np.searchsorted(self.offsets, visible, side="right") - 1
+        for index, element in zip(visible.tolist(), elements.tolist()):
+            points, evenodd = self.polygons[index]
+            points = self._crop_side(points, left, 1)
+            points = self._crop_side(points, right, -1)
+            if len(points) < 3:
+                continue
+            coordinates = np.round(points, 4).tolist()
+            ring = "M " + " ".join(f"{x},{y}" for x, y in coordinates) + " Z"
+            rings.setdefault(element, ([], evenodd))[0].append(ring)
+        return [(" ".join(paths), evenodd) for paths, evenodd in rings.values()]
+
+    def to_clip(self, paths):
+        """inserts a clip path with the cropped paths into the svg, returns the clip"""
+        clip = ClipPath()
+        for path, evenodd in paths:
+            element = PathElement(d=path)
+            if evenodd:
+                element.style["clip-rule"] = "evenodd"
+            clip.append(element)
+        self.svg.defs.add(clip)
+        return clip
+
+    @staticmethod
+    def _crop_side(points, limit, side):
+        """crops a closed polygon to side * x >= side * limit"""
+        if len(points) == 0:
+            return points
+        inside = side * points[:, 0] >= side * limit
+        if inside.all():
+            return points
+        start = np.roll(points, 1, axis=0)
+        start_inside = np.roll(inside, 1)
+        crossing = start_inside != inside
+        # intersections of the crossing edges with the crop line
+        # (vertical edges never cross it, avoid dividing by zero)
+        delta_x = points[:, 0] - start[:, 0]
+        delta_x[delta_x == 0] = 1
+        ratio = (limit - start[:, 0]) / delta_x
+        intersection = np.column_stack(
+            (
+                np.full(len(points), limit),
+                start[:, 1] + ratio * (points[:, 1] - start[:, 1]),
+            )
+        )
+        # each edge emits its intersection (if any) followed by its end (if inside)
+        candidates = np.stack((intersection, points), axis=1).reshape(-1, 2)
+        keep = np.column_stack((crossing, inside)).reshape(-1)
+        return candidates[keep]
+
+
 class Lines:  # pylint: disable=too-many-instance-attributes
     """Serves to generate the lines which are representing the book pages"""
 
@@ -176,21 +1248,38 @@ class Lines:  # pylint: disable=too-many-instance-attributes
         design_bbox,
         design_clips,
         settings,
+        page_key=None,
+        previous_pages=None,
+        page_range=None,
     ):
         self.settings = settings
-        self.colors = design_colors + settings["highlight_colors"]
+        self.colors = design_colors + list(settings.highlight_colors)
         self.num_lines = num_lines
         self.num_pages = num_pages
         self.design_clips = design_clips
-        self.first_page = ceil(settings["first_page"] / 2)
-        self.last_page = ceil(settings["last_page"] / 2)
+        self.first_page = settings.first_line
+        self.last_page = settings.last_line
         self.design_bbox = design_bbox
 
+        # layout of each page, the svg elements are only generated by materialize()
+        self.pages = []
         self.line_groups = []
+        # page_key(page index, left, right) returns a hash of the page content,
+        # pages with a key of previous_pages ({key: page group}) are reused
+        self.page_key = page_key
+        self.previous_pages = previous_pages or {}
+        self.reused = set()
+        # indices of the pages to generate (None: all pages), the pages are laid out
+        # like in a full run
+        self.page_range = range(num_pages) if page_range is None else page_range
+        # compact path data and labels (see CompactEncoder)
+        self.encoder = None
+        if settings.precision is not None:
+            self.encoder = CompactEncoder(settings.precision)
         self.make_lines()
 
     def __repr__(self):
-        return f"Lines({self.line_groups})"
+        return f"Lines({self.pages})"
 
     def _get_line_bbox(self):
         left = self.design_bbox.left
@@ -198,109 +1287,513 @@ class Lines:  # pylint: disable=too-many-instance-attributes
         right = self.design_bbox.right
         bottom = self.design_bbox.bottom
 
-        left -= self.settings["pages_before"] * self.settings["line_distance"]
-        right += self.settings["pages_after"] * self.settings["line_distance"]
+        settings = self.settings
+        left -= settings.pages_before * settings.line_distance
+        right += settings.pages_after * settings.line_distance
 
-        spacing = (self.settings["book_height"] - self.design_bbox.height) / 2
-        if self.settings["margin_bottom"] != 0:
-            bottom = bottom + self.settings["margin_bottom"]
-            top = bottom - self.settings["book_height"]
+        spacing = (settings.book_height - self.design_bbox.height) / 2
+        if settings.margin_bottom != 0:
+            bottom = bottom + settings.margin_bottom
+            top = bottom - settings.book_height
         else:
             top = top - spacing
             bottom = bottom + spacing
 
         return {"left": left, "top": top, "right": right, "bottom": bottom}
 
+    def _line_layout(self, left):
+        """computes x positions, line numbers and highlight classes of all lines at once
+
+        returns arrays with one row per page and one column per line, plus one extra
+        column for the position following the last line of each page
+        line classes: 0 = background, 1 = every 5th line, 2 = every 10th line
+        """
+        line_distance = self.settings.line_distance
+        page_offsets = np.arange(self.num_pages) * self.num_lines
+
+        # cumsum adds sequentially, so the positions are exactly the same as when
+        # adding up the line distance line by line
+        steps = np.full((self.num_pages, self.num_lines + 1), line_distance)
+        steps[:, 0] = left + page_offsets * line_distance
+        positions = np.cumsum(steps, axis=1)
+
+        line_numbers = (
+            self.first_page + page_offsets[:, None] + np.arange(self.num_lines + 1)
+        )
+        classes = (line_numbers % 5 == 0).astype(int) + (line_numbers % 10 == 0)
+        return positions, line_numbers, classes
+
+    def _page_labels(self, positions, line_numbers):
+        """returns the page number labels (x position, page number, size) of a page
+        and the number of lines which are within the page range"""
+        valid = line_numbers[:-1] <= self.last_page
+        num_valid = int(np.count_nonzero(valid))
+        index = np.arange(self.num_lines)
+        normal = valid & (line_numbers[:-1] % 10 == 0)
+        small = valid & ~normal & ((index == 0) | (index == self.num_lines - 1))
+        line_numbers = line_numbers.tolist()
+        labels = [
+            (positions[k], line_numbers[k] * 2, "normal" if normal[k] else "small")
+            for k in np.flatnonzero(normal | small).tolist()
+        ]
+        if num_valid < self.num_lines:
+            # the last page ends early: label the last line if not done already
+            line_number = line_numbers[num_valid]
+            if (line_number - 1) % 10 != 0:
+                left = positions[num_valid] - self.settings.line_distance
+                labels.append((left, (line_number - 1) * 2, "small"))
+        return labels, num_valid
+
     def make_lines(self):
-        """generates the lines and make sure we insert the text elements"""
+        """computes the layout of the lines and labels of each page"""
+        self.line_bbox = self._get_line_bbox()
+        line_distance = self.settings.line_distance
+        positions, line_numbers, classes = self._line_layout(self.line_bbox["left"])
+        for i in self.page_range:
+            page_positions = positions[i].tolist()
+            labels, num_valid = self._page_labels(page_positions, line_numbers[i])
+            left = page_positions[0]
+            right = page_positions[max(num_valid, 1) - 1]
+            page = LinePage(
+                positions[i, :num_valid],
+                classes[i, :num_valid],
+                [Label(*label) for label in labels],
+                BoundingBox(
+                    (left, right), (self.line_bbox["top"], self.line_bbox["bottom"])
+                ),
+            )
+            page.index = i
+            # x range of the page content, including the line strokes at the borders
+            page.x_range = (left - line_distance, right + line_distance)
+            if self.page_key is not None:
+                page.key = self.page_key(i, *page.x_range)
+                if page.key in self.previous_pages:
+                    page.group = self.previous_pages.pop(page.key)
+                    self.reused.add(i)
+            self.pages.append(page)
+
+    def materialize(self, processes=1):
+        """generates the svg group of each page (reused pages keep their group)"""
+        self.line_groups = list(self.iter_page_groups(processes))
+        return self.line_groups
+
+    def iter_page_groups(self, processes=1):
+        """generates the svg groups one page at a time, the path data of the pages
+        is computed by worker processes if processes is not 1 (None: all cpus)"""
+        fragments = None
+        if processes != 1:
+            new_pages = [page for page in self.pages if page.group is None]
+            fragments = self.page_fragments().map(new_pages, processes)
+        for page in self.pages:
+            fragment = None
+            if fragments is not None and page.group is None:
+                fragment = next(fragments)
+            yield self._page_group(page, fragment)
+
+    def page_fragments(self, encoder=False):
+        """returns the path data builder of the pages (encoder False: own encoder)"""
+        if encoder is False:
+            encoder = self.encoder
+        return PageFragments(
+            len(self.colors), self.design_clips, self.line_bbox, encoder
+        )
 
-        line_bbox = self._get_line_bbox()
-        num_colors = len(self.colors)
-        for i in range(self.num_pages):
+    def _page_group(self, page, fragment=None):
+        """returns the svg group with the lines and labels of a page"""
+        page_group = page.group
+        if page_group is None:
             page_group = Group()
-            text = Text(self.settings["font_size"], line_bbox["bottom"])
-            for j in range(num_colors):
-                line_number = self.first_page + (i * self.num_lines)
-                left = line_bbox["left"] + (
-                    i * self.num_lines * self.settings["line_distance"]
-                )
-                style = (
-                    f"fill:none;stroke:{self.colors[j]};"
-                    f"stroke-width:{self.settings['stroke_width']}"
-                )
-                lines = PathElement(style=style)
-                path = ""
-                for k in range(self.num_lines):
-                    if line_number > self.last_page:
-                        if not (line_number - 1) % 10 == 0:
-                            left -= self.settings["line_distance"]
-                            text.add_text(left, (line_number - 1) * 2, "small")
-                        break
-                    if line_number % 10 == 0:
-                        text.add_text(left, line_number * 2)
-                    elif k in (0, self.num_lines - 1):
-                        text.add_text(left, line_number * 2, "small")
-
-                    if j == num_colors - 1 and line_number % 10 != 0:
-                        left += self.settings["line_distance"]
-                        line_number += 1
-                        continue
-                    if j == num_colors - 2 and (
-                        line_number % 10 == 0 or line_number % 5 != 0
-                    ):
-                        left += self.settings["line_distance"]
-                        line_number += 1
-                        continue
-                    if j == num_colors - 3 and line_number % 5 == 0:
-                        left += self.settings["line_distance"]
-                        line_number += 1
-                        continue
-                    path += (
-                        f"M {left} {line_bbox['top']} L {left} {line_bbox['bottom']} "
-                    )
-                    left += self.settings["line_distance"]
-                    line_number += 1
-                lines.set("d", path)
-                if j < len(self.design_clips):
+            if page.key is not None:
+                page_group.set("data-bookart-page", page.key)
+            self._add_lines(page_group, page, fragment)
+        if page.translate is not None:
+            page_group.set("transform", "translate({}, {})".format(*page.translate))
+        return page_group
+
+    def _add_lines(self, page_group, page, fragment=None):
+        """inserts the lines and labels of a page into the page group"""
+        if fragment is None:
+            fragment = self.page_fragments().page(
+                page.positions, page.classes, page.x_range
+            )
+        paths, clips = fragment
+        encoder = self.encoder
+        text = Text(self.settings.font_size, self.line_bbox["bottom"], encoder)
+        if encoder is not None:
+            # identical labels on top of each other don't change the rendering
+            for label in page.labels:
+                text.add_text(label.x_position, label.text, label.size)
+        for j, color in enumerate(self.colors):
+            if encoder is None:
+                for label in page.labels:
+                    text.add_text(label.x_position, label.text, label.size)
+
+            style = (
+                f"fill:none;stroke:{color};"
+                f"stroke-width:{self.settings.stroke_width}"
+            )
+            lines = PathElement(style=style)
+            lines.set("d", paths[j])
+            if j < len(self.design_clips):
+                if isinstance(self.design_clips[j], ClipPath):
                     lines.clip = self.design_clips[j]
-                page_group.insert(0, lines)
-            page_group.insert(0, text.text_element)
-            self.line_groups.append(page_group)
+                elif isinstance(self.design_clips[j], PageClip):
+                    lines.clip = self.design_clips[j].to_clip(clips[j])
+            page_group.insert(0, lines)
+        page_group.insert(0, text.text_element)
+        if text.small_text_element is not None:
+            page_group.insert(1, text.small_text_element)
+        if page.bottom_line:
+            style = (
+                f"fill:none; stroke:black; stroke-width:{self.settings.stroke_width}"
+            )
+            bbox = page.bbox
+            line = PathElement(style=style)
+            line.set("d", f"M {bbox.left}, {bbox.bottom} {bbox.right}, {bbox.bottom}")
+            page_group.append(line)
+
+    def path_data_size(self, encoder=None):
+        """returns the size of the line path data of all generated pages with the
+        given encoder (None: verbose absolute coordinates)"""
+        fragments = self.page_fragments(encoder)
+        size = 0
+        for page in self.pages:
+            if page.group is not None:
+                continue
+            for j in range(len(self.colors)):
+                positions = fragments.color_positions(j, page.positions, page.classes)
+                size += len(fragments.lines_path(j, positions))
+        return size
+
+    def fold_zones(self, clip, min_gap=0):
+        """returns the page number and the fold zones (top, bottom) of each line,
+        measured from the top of the book"""
+        line_bbox = self._get_line_bbox()
+        positions, line_numbers, _ = self._line_layout(line_bbox["left"])
+        valid = line_numbers[:, :-1] <= self.last_page
+        positions = positions[:, :-1][valid]
+        line_numbers = line_numbers[:, :-1][valid]
+
+        top = line_bbox["top"]
+        zones = clip.scan(positions, top, line_bbox["bottom"], min_gap)
+        return [
+            (line_number * 2, [(start - top, end - top) for start, end in line_zones])
+            for line_number, line_zones in zip(line_numbers.tolist(), zones)
+        ]
+
+    def page_extents(self, page):
+        """returns the extents of the lines and labels of a page"""
+        bbox = page.bbox
+        # the labels below the lines (they may reach into the page margins at the
+        # sides, just like with one page per document page)
+        return BoundingBox(
+            bbox.x, (bbox.top, bbox.bottom + self.settings.font_size * 1.25 + 2)
+        )
 
-    def add_to_document(self, layer):
-        """inserts the lines into the svg"""
-        for lines in self.line_groups:
+    def add_to_document(self, layer, processes=1):
+        """generates the svg elements of the lines and inserts them into the svg"""
+        for lines in self.materialize(processes):
             layer.insert(0, lines)
 
     def add_bottom_lines(self):
-        """Inserts a helper line at the bottom of the lines for aligning the book"""
-        style = f"fill:none; stroke:black; stroke-width:{self.settings['stroke_width']}"
-        for linegroup in self.line_groups:
-            bbox = linegroup.getchildren()[-1].shape_box()
-            line = PathElement(style=style)
-            line.set("d", f"M {bbox.left}, {bbox.bottom} {bbox.right}, {bbox.bottom}")
-            linegroup.append(line)
+        """Adds a helper line at the bottom of the lines for aligning the book"""
+        for page in self.pages:
+            page.bottom_line = True
+
+
+# path data builder of the worker process (see PageFragments.map)
+_PAGE_FRAGMENTS = None
+
+
+def _init_page_worker(fragments):
+    """stores the path data builder in the worker process"""
+    global _PAGE_FRAGMENTS  # pylint: disable=global-statement
+    _PAGE_FRAGMENTS = fragments
+
+
+def _page_worker(task):
+    """returns the fragment of a page in the worker process"""
+    return _PAGE_FRAGMENTS.page(*task)
+
+
+class PageFragments:
+    """Computes the path data of the lines and the cropped clip paths of pages
+
+    It holds no svg elements, so it can be sent to worker processes. A fragment is a
+    list with the path data of each color and a list with the cropped clip paths
+    (path data, evenodd) of each color (None if the color has no page clip).
+    """
+
+    def __init__(self, num_colors, design_clips, line_bbox, encoder=None):
+        self.num_colors = num_colors
+        # shared clip paths are svg elements, they are set by the main process
+        self.clips = [
+            None if isinstance(clip, ClipPath) else clip for clip in design_clips
+        ]
+        self.top = line_bbox["top"]
+        self.bottom = line_bbox["bottom"]
+        self.encoder = encoder
+
+    def color_positions(self, color_index, positions, classes):
+        """returns the x positions of the lines of a color (highlight colors are
+        only drawn on every 5th or 10th line)"""
+        num_design_colors = self.num_colors - 3
+        if color_index >= num_design_colors:
+            positions = positions[classes == color_index - num_design_colors]
+        return positions.tolist()
+
+    def page(self, positions, classes, x_range):
+        """returns the fragment of a page"""
+        paths = []
+        clips = []
+        for j in range(self.num_colors):
+            paths.append(
+                self.lines_path(j, self.color_positions(j, positions, classes))
+            )
+            clip = self.clips[j] if j < len(self.clips) else None
+            clips.append(
+                clip.crop_paths(*x_range) if isinstance(clip, PageClip) else None
+            )
+        return paths, clips
+
+    def map(self, pages, processes=None):
+        """yields the fragments of the pages (in page order), computed by a pool of
+        worker processes"""
+        tasks = [(page.positions, page.classes, page.x_range) for page in pages]
+        workers = processes or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(
+            processes, initializer=_init_page_worker, initargs=(self,)
+        ) as executor:
+            yield from executor.map(_page_worker, tasks, chunksize=chunksize)
+
+    def lines_path(self, color_index, positions):
+        """returns the path data of the lines at the given x positions,
+        only the visible parts for scanline and raster clips"""
+        top = self.top
+        bottom = self.bottom
+        encoder = self.encoder
+        clip = self.clips[color_index] if color_index < len(self.clips) else None
+        if isinstance(clip, (ScanlineClip, RasterClip)):
+            intervals = clip.scan(positions, top, bottom)
+            if encoder is not None:
+                return encoder.intervals(positions, intervals)
+            return "".join(
+                [
+                    f"M {x_position} {start} L {x_position} {end} "
+                    for x_position, line_intervals in zip(positions, intervals)
+                    for start, end in line_intervals
+                ]
+            )
+        if encoder is not None:
+            return encoder.lines(positions, top, bottom)
+        return "".join(
+            [
+                f"M {x_position} {top} L {x_position} {bottom} "
+                for x_position in positions
+            ]
+        )
+
+
+class LinePage:  # pylint: disable=too-few-public-methods
+    """Layout of the lines of one page
+
+    positions and classes are array views into the layout of all pages, so a page
+    costs only a few small objects until its svg elements are generated.
+    """
+
+    __slots__ = (
+        "index",
+        "positions",
+        "classes",
+        "labels",
+        "bbox",
+        "x_range",
+        "key",
+        "group",
+        "bottom_line",
+        "translate",
+    )
+
+    def __init__(self, positions, classes, labels, bbox):
+        # position of the page in the book (document page number - 1)
+        self.index = None
+        self.positions = positions
+        self.classes = classes
+        self.labels = labels
+        # extents of the lines (known from the layout, no need to parse the
+        # generated path data)
+        self.bbox = bbox
+        self.x_range = (bbox.left, bbox.right)
+        self.key = None
+        # svg group of a previous run, if the page is reused
+        self.group = None
+        self.bottom_line = False
+        self.translate = None
+
+    def __repr__(self):
+        return f"LinePage({self.bbox.left}, {self.bbox.right}, {len(self.positions)})"
+
+
+class Label:  # pylint: disable=too-few-public-methods
+    """A page number label"""
+
+    __slots__ = ("x_position", "text", "size")
+
+    def __init__(self, x_position, text, size="normal"):
+        self.x_position = x_position
+        self.text = text
+        self.size = size
 
 
 class Text:  # pylint: disable=too-few-public-methods
     """Holds the text for the page numbers"""
 
-    def __init__(self, font_size, y_position):
+    def __init__(self, font_size, y_position, encoder=None):
         self.font_size = font_size
+        self.encoder = encoder
         self.style = f"text-anchor:middle;font-size:{font_size}"
-        self.small_style = f"text-anchor:middle;font-size:{font_size / 2};fill:grey;"
-        self.text_element = TextElement(
-            y=str(y_position + self.font_size + 2), style=self.style
+        # parse the style once, setting a style attribute on each tspan is expensive
+        self.small_style = str(
+            Style(f"text-anchor:middle;font-size:{font_size / 2};fill:grey;")
         )
+        y_position = str(y_position + self.font_size + 2)
+        self.text_element = TextElement(y=y_position, style=self.style)
+        # compact: small labels share one text element instead of a style per tspan
+        self.small_text_element = None
+        if encoder is not None:
+            self.small_text_element = TextElement(y=y_position, style=self.small_style)
 
     def add_text(self, x_position, text, size="normal"):
         """adds a new tspan element"""
+        if self.encoder is not None:
+            tspan = Tspan(str(int(text)), x=self.encoder.coordinate(x_position))
+            if size == "small":
+                self.small_text_element.insert(0, tspan)
+            else:
+                self.text_element.insert(0, tspan)
+            return
         tspan = Tspan(str(int(text)), x=str(x_position))
         if size == "small":
-            tspan.set("style", self.small_style)
+            tspan.attrib["style"] = self.small_style
         self.text_element.insert(0, tspan)
 
 
+class CompactEncoder:
+    """Encodes path data and coordinates with a fixed number of decimals
+
+    Coordinates are rounded to integers in units of 10^-precision, so relative
+    moves are computed exactly and rounding errors don't add up along the page.
+    Lines use relative m/v commands: with a constant line distance the same
+    short move repeats for every line.
+    """
+
+    def __init__(self, precision=3):
+        self.precision = max(0, int(precision))
+        self.scale = 10**self.precision
+        self._numbers = {}
+
+    def to_int(self, values):
+        """returns the values in units of 10^-precision"""
+        return np.rint(np.asarray(values, dtype=float) * self.scale).astype(np.int64)
+
+    def number(self, value):
+        """formats an integer value (in units of 10^-precision) as short as possible"""
+        text = self._numbers.get(value)
+        if text is None:
+            whole, fraction = divmod(abs(value), self.scale)
+            fraction = f"{fraction:0{self.precision}d}".rstrip("0")
+            text = str(whole) if not fraction else f"{whole or ''}.{fraction}"
+            if value < 0:
+                text = "-" + text
+            self._numbers[value] = text
+        return text
+
+    def coordinate(self, value):
+        """returns a single rounded coordinate"""
+        return self.number(int(self.to_int(value)))
+
+    def pair(self, x_value, y_value):
+        """formats two numbers, the minus sign separates them as well"""
+        y_text = self.number(y_value)
+        separator = "" if y_text[0] == "-" else " "
+        return f"{self.number(x_value)}{separator}{y_text}"
+
+    def lines(self, positions, top, bottom):
+        """returns the path data of full height lines at the x positions"""
+        if len(positions) == 0:
+            return ""
+        x_values = self.to_int(positions)
+        top, bottom = self.to_int([top, bottom]).tolist()
+        height = self.number(bottom - top)
+        parts = [f"M{self.pair(int(x_values[0]), top)}v{height}"]
+        for step in np.diff(x_values).tolist():
+            parts.append(f"m{self.pair(step, top - bottom)}v{height}")
+        return "".join(parts)
+
+    def intervals(self, positions, intervals):
+        """returns the path data of the visible (start, end) intervals of each line"""
+        parts = []
+        current = None
+        for x_position, line_intervals in zip(positions, intervals):
+            if not line_intervals:
+                continue
+            x_value = int(self.to_int(x_position))
+            values = self.to_int(line_intervals).tolist()
+            for start, end in values:
+                if current is None:
+                    parts.append(f"M{self.pair(x_value, start)}")
+                else:
+                    parts.append(
+                        f"m{self.pair(x_value - current[0], start - current[1])}"
+                    )
+                parts.append(f"v{self.number(end - start)}")
+                current = (x_value, end)
+        return "".join(parts)
+
+
+class Measurements:
+    """Table of the fold zones of every page, exported as csv or json"""
+
+    def __init__(self, fold_zones, unit, unit_size):
+        self.unit = unit
+        self.unit_size = unit_size
+        self.pages = [
+            (page_number, [self._convert(zone) for zone in zones])
+            for page_number, zones in fold_zones
+        ]
+
+    def _convert(self, zone):
+        """converts a zone from user units into the output unit"""
+        return tuple(round(value / self.unit_size, 3) for value in zone)
+
+    def save(self, file_name):
+        """writes the table, the file extension defines the format (.json or .csv)"""
+        with open(file_name, "w", encoding="utf-8", newline="") as stream:
+            if file_name.lower().endswith(".json"):
+                self.write_json(stream)
+            else:
+                self.write_csv(stream)
+
+    def write_csv(self, stream):
+        """writes one row per fold zone (and an empty row for pages without zones)"""
+        writer = csv.writer(stream)
+        writer.writerow(["page", "zone", f"top ({self.unit})", f"bottom ({self.unit})"])
+        for page_number, zones in self.pages:
+            if not zones:
+                writer.writerow([page_number, "", "", ""])
+            for i, (top, bottom) in enumerate(zones, start=1):
+                writer.writerow([page_number, i, top, bottom])
+
+    def write_json(self, stream):
+        """writes the fold zones as a list of pages"""
+        pages = [
+            {"page": page_number, "zones": [list(zone) for zone in zones]}
+            for page_number, zones in self.pages
+        ]
+        json.dump({"unit": self.unit, "pages": pages}, stream)
+
+
 class Pages:
     """Holds information about the pages"""
 
@@ -308,51 +1801,40 @@ class Pages:
         self.svg = svg
         self.settings = settings
 
-        self.width = self.height = None
+        self.width = settings.page_width
+        self.height = settings.page_height
         self.pages = []
-        self.document_bbox(self.settings["document_format"])
         self.set_viewbox_size()
 
     def page_content_area(self):
         """returns the width of the page, excluding page margins"""
-        margin = self.settings["page_margins"] * 2
-        return self.width - margin
+        return self.settings.content_width
 
     @property
     def num_lines_per_page(self):
         """returns how many lines fit on one page"""
-        return ceil(self.page_content_area() / self.settings["line_distance"])
+        return self.settings.lines_per_page
 
     @property
     def num_pages(self):
         """returns number of necessary pages"""
-        num_pages = (
-            self.settings["line_distance"]
-            * self.settings["total_pages"]
-            / self.page_content_area()
-        )
-        return ceil(num_pages)
+        return self.settings.num_pages
 
-    def document_bbox(self, document_format):
-        """returns width and height of one page"""
+    @staticmethod
+    def document_size(svg, document_format):
+        """returns width and height of one page (user units)"""
         if document_format == "letter":
             # US Letter: 8.5 * 11 (in)
-            self.width, self.height = (
-                self.svg.viewport_to_unit("8.5in"),
-                self.svg.viewport_to_unit("11in"),
-            )
-        else:
-            # A4: 210 x 297 (mm)
-            self.width, self.height = (
-                self.svg.viewport_to_unit("210mm"),
-                self.svg.viewport_to_unit("297mm"),
-            )
+            return svg.viewport_to_unit("8.5in"), svg.viewport_to_unit("11in")
+        # A4: 210 x 297 (mm)
+        return svg.viewport_to_unit("210mm"), svg.viewport_to_unit("297mm")
 
-    def set_viewbox_size(self):
-        """set viewbox size to page size, to avoid bad scaling"""
+    def set_viewbox_size(self, left=0):
+        """set viewbox size to page size, to avoid bad scaling
+        left: x position of the first page"""
         self.svg.set("height", f"{self.height}{self.svg.unit}")
         self.svg.set("width", f"{self.width}{self.svg.unit}")
-        self.svg.set("viewBox", f"0 0 {self.width} {self.height}")
+        self.svg.set("viewBox", f"{left} 0 {self.width} {self.height}")
 
     def add_page(self, page_num):
         """add a new page"""
@@ -373,40 +1855,475 @@ class Pages:
             if page not in self.pages:
                 self.svg.namedview.remove(page)
 
-    def generate_pages_with_lines(self, line_groups):
-        """add pages and center out line groups"""
-        for i, line_group in enumerate(line_groups):
-            page = self.add_page(i)
-            self.fit_on_page(page, line_group)
+    def generate_pages_with_lines(self, line_pages, extents=None):
+        """add pages and center out the lines of each page
+        if the extents of the page groups are given, the groups are packed onto as
+        few pages as possible instead"""
+        if extents is not None:
+            self.pack_pages_with_lines(line_pages, extents)
+        else:
+            for i, line_page in enumerate(line_pages):
+                page = self.add_page(i if line_page.index is None else line_page.index)
+                line_page.translate = self.fit_on_page(page, line_page.bbox)
+                if i == 0 and page.x != 0:
+                    # part of the pages (see Bookart.page_range): the pages keep the
+                    # position of the full run, the first page defines the viewbox
+                    self.set_viewbox_size(page.x)
         self.cleanup_pages()
 
-    def fit_on_page(self, page, group):
-        """center line groups on pages"""
-        # the bounding box of the group is somehow off,
-        # lets use the bounding box of the lines element
-        group_bbox = group.getchildren()[3].bounding_box()
-
-        page_center_x = page.x + (page.width / 2)
+    def pack_pages_with_lines(self, line_pages, extents):
+        """add pages and pack the page groups (extents: lines and labels) onto them"""
+        packer = SheetPacker(self.width, self.height, self.settings.page_margins)
+        placements = packer.pack([(extent.width, extent.height) for extent in extents])
+        num_pages = max((placement[0] for placement in placements), default=-1) + 1
+        pages = [self.add_page(i) for i in range(num_pages)]
+        for line_page, extent, (index, x, y) in zip(line_pages, extents, placements):
+            line_page.translate = (pages[index].x + x - extent.left, y - extent.top)
+
+    def fit_on_page(self, page, group_bbox):
+        """returns the translation which centers lines on a page
+        group_bbox: the extents of the lines (the group bounding box would include
+        the page numbers)"""
+        return self.center(group_bbox, page.x, page.width, page.height)
+
+    def center(self, group_bbox, page_x=0, width=None, height=None):
+        """returns the translation which centers the extents on a page at page_x"""
+        width = self.width if width is None else width
+        height = self.height if height is None else height
+
+        page_center_x = page_x + (width / 2)
         group_center_x = group_bbox.center_x
         transform_x = page_center_x - group_center_x
 
-        page_center_y = page.height / 2
+        page_center_y = height / 2
         group_center_y = group_bbox.center_y
         transform_y = page_center_y - group_center_y
 
-        group.set("transform", f"translate({transform_x}, {transform_y})")
+        return transform_x, transform_y
 
     def __repr__(self):
         return f"Pages({self.width}, {self.height}, {self.pages})"
 
 
+class SheetPacker:
+    """Packs rectangles onto pages of the same size (best fit decreasing height)
+
+    The rectangles are sorted by height and placed side by side in shelves (rows).
+    A rectangle goes into the shelf with the least remaining width it fits into, a
+    new shelf onto the page with the least remaining height. Shelves and pages are
+    kept sorted by their remaining space, so each placement is a binary search.
+    """
+
+    def __init__(self, width, height, margin, spacing=None):
+        """margin: minimum distance to the page border
+        spacing: distance between rectangles (default: the margin)"""
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self.spacing = margin if spacing is None else spacing
+
+    def pack(self, sizes):
+        """sizes: list of (width, height)
+        returns the page index and the position (x, y) on the page of each rectangle
+        rectangles larger than the page content area get a page of their own"""
+        spacing = self.spacing
+        content_width = self.width - 2 * self.margin + spacing
+        content_height = self.height - 2 * self.margin + spacing
+        placements = [None] * len(sizes)
+        # (remaining width, shelf index) and (remaining height, page index)
+        free_shelves = []
+        free_pages = []
+        shelves = []
+        num_pages = 0
+        order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+        for i in order:
+            width = sizes[i][0] + spacing
+            height = sizes[i][1] + spacing
+            if width > content_width or height > content_height:
+                x = (self.width - sizes[i][0]) / 2
+                y = (self.height - sizes[i][1]) / 2
+                placements[i] = (num_pages, x, y)
+                num_pages += 1
+                continue
+            # shelves are at least as high as the rectangle (decreasing heights)
+            found = bisect_left(free_shelves, (width, -1))
+            if found < len(free_shelves):
+                free_width, shelf = free_shelves.pop(found)
+            else:
+                found = bisect_left(free_pages, (height, -1))
+                if found < len(free_pages):
+                    free_height, page = free_pages.pop(found)
+                else:
+                    free_height, page = content_height, num_pages
+                    num_pages += 1
+                y = self.margin + content_height - free_height
+                insort(free_pages, (free_height - height, page))
+                shelf = len(shelves)
+                shelves.append((page, y))
+                free_width = content_width
+            page, y = shelves[shelf]
+            placements[i] = (page, self.margin + content_width - free_width, y)
+            insort(free_shelves, (free_width - width, shelf))
+        return placements
+
+
+class PageWriter:
+    """Writes each page into a standalone svg file
+
+    Pages are written one at a time from a generator of page groups, so that memory
+    stays flat for any number of pages and the first pages can be printed while the
+    others are still being generated.
+    """
+
+    def __init__(self, directory, svg, width, height):
+        self.directory = directory
+        self.svg = svg
+        self.header = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{width}{svg.unit}" height="{height}{svg.unit}" '
+            f'viewBox="0 0 {width} {height}">'
+        ).encode()
+        # serialized clip paths which are used on several pages
+        self.shared = {}
+
+    def write_all(self, page_groups, shared_clips=(), indices=None):
+        """writes all pages, returns the written file names
+        indices: page numbers of the files (default: 0, 1, 2, ...)"""
+        for clip in shared_clips:
+            clip_id = clip.get_id()
+            # elements referenced by the clip (keep_design) go into the defs as well
+            referenced = [use.href for use in clip.iter(addNS("use", "svg"))]
+            self.shared[clip_id] = b"".join(
+                etree.tostring(element)
+                for element in [clip] + referenced
+                if element is not None
+            )
+        os.makedirs(self.directory, exist_ok=True)
+        if indices is None:
+            indices = count()
+        return [
+            self.write(i, page_group) for i, page_group in zip(indices, page_groups)
+        ]
+
+    def write(self, index, page_group):
+        """writes one page with the clip paths it uses, returns the file name
+        clip paths which are only used on this page are removed from the document"""
+        defs = []
+        for clip_id in sorted(set(page_group.xpath(".//@clip-path"))):
+            clip_id = clip_id[5:-1]
+            if clip_id in self.shared:
+                defs.append(self.shared[clip_id])
+                continue
+            clip = self.svg.getElementById(clip_id)
+            if clip is not None:
+                defs.append(etree.tostring(clip))
+                clip.getparent().remove(clip)
+
+        file_name = os.path.join(self.directory, f"page_{index + 1:04d}.svg")
+        with open(file_name, "wb") as stream:
+            stream.write(self.header)
+            stream.write(b"<defs>" + b"".join(defs) + b"</defs>")
+            stream.write(etree.tostring(page_group))
+            stream.write(b"</svg>")
+        return file_name
+
+
+class GeometryCache:
+    """On-disk cache of the composed transforms, pattern groups, bounding box and
+    flattened geometry of designs, keyed by a content hash of the design
+
+    Each entry is a .npz file. Loading an entry marks it as recently used, the least
+    recently used entries are removed when the cache grows larger than max_size.
+    """
+
+    # increase when the entry format or the geometry computation changes
+    VERSION = 3
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        """returns the file name of an entry"""
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key):
+        """returns the arrays of an entry (or None if it doesn't exist or is broken)"""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def store(self, key, entry):
+        """writes an entry and removes old entries if the cache is too large"""
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first, other processes may read the entry already
+        handle, temp_file = tempfile.mkstemp(suffix=".npz", dir=self.directory)
+        with os.fdopen(handle, "wb") as stream:
+            np.savez(stream, **entry)
+        os.replace(temp_file, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits max_size"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+
+
+class PreviousOutput:
+    """The Book Art layer of a previous run
+
+    Page groups carry a hash of their content (data-bookart-page). The layer lists the
+    clip paths (data-bookart-clips) or the group (data-bookart-design) in the defs
+    which hold the design elements.
+    """
+
+    LABEL = "Book Art"
+    # increase when the generated pages change for the same settings
+    VERSION = 1
+
+    def __init__(self, svg):
+        self.svg = svg
+        self.layer = None
+        self.design_clips = []
+        self.design_group = None
+        self.page_clips = []
+        self.pages = {}
+        for layer in svg.xpath("./svg:g[@inkscape:groupmode='layer']"):
+            if layer.label == self.LABEL:
+                self.layer = layer
+                break
+        if self.layer is None:
+            return
+
+        for group in self.layer:
+            key = group.get("data-bookart-page")
+            if key is not None:
+                self.pages[key] = group
+        self.design_group = self._element(self.layer.get("data-bookart-design"))
+        clips = self.referenced_clips(self.layer)
+        if self.layer.get("data-bookart-clips") is not None:
+            clip_ids = self.layer.get("data-bookart-clips").split()
+            self.design_clips = [self._element(clip_id) for clip_id in clip_ids]
+            self.design_clips = [clip for clip in self.design_clips if clip is not None]
+        else:
+            # older version without metadata: design clips contain pattern groups
+            self.design_clips = [
+                clip for clip in clips if any(isinstance(c, Group) for c in clip)
+            ]
+        self.page_clips = [clip for clip in clips if clip not in self.design_clips]
+
+    def _element(self, element_id):
+        """returns the element with the given id (or None)"""
+        if not element_id:
+            return None
+        return self.svg.getElementById(element_id)
+
+    def referenced_clips(self, container):
+        """returns the clip paths which are used within the container"""
+        clips = []
+        for element in container.xpath(".//*[@clip-path]"):
+            clip_id = element.get("clip-path")
+            if clip_id.startswith("url(#"):
+                clip = self._element(clip_id[5:-1])
+                if clip is not None and clip not in clips:
+                    clips.append(clip)
+        return clips
+
+    def excluded(self):
+        """returns the containers which don't hold design elements"""
+        if self.layer is None:
+            return []
+        return [self.layer] + self.page_clips
+
+    def design_containers(self):
+        """returns the clip paths or the group in the defs which hold the design"""
+        containers = self.design_clips + [self.design_group]
+        return [container for container in containers if container is not None]
+
+    def release_design(self):
+        """removes the scale transforms of the previous pattern groups, so that the
+        composed transforms of the design elements don't include them"""
+        for container in self.design_clips + [self.design_group]:
+            if container is None:
+                continue
+            for child in container:
+                if isinstance(child, Group):
+                    child.attrib.pop("transform", None)
+
+    def restore_design(self):
+        """moves the pattern groups which hold design elements (moved into the defs by
+        a previous run) back into the drawing, a layer above the book art layer
+        returns the layer (None if there is nothing to restore)"""
+        # design clips are listed from the top, groups are stacked from the bottom
+        groups = [
+            child
+            for container in self.design_clips[::-1] + [self.design_group]
+            if container is not None
+            for child in container
+            if isinstance(child, Group)
+            and next(child.iter(*ElementCollector.SHAPES), None) is not None
+        ]
+        if not groups:
+            return None
+        layer = Layer()
+        layer.label = f"{self.LABEL} design"
+        self.layer.addnext(layer)
+        for group in groups:
+            layer.append(group)
+        return layer
+
+    def design_clip(self, index):
+        """returns the design clip of the previous run at the index (or None)"""
+        if index < len(self.design_clips):
+            return self.design_clips[index]
+        return None
+
+    def new_layer(self):
+        """returns the empty layer for the new output (the previous one if it exists)"""
+        if self.layer is None:
+            layer = Layer()
+            layer.label = self.LABEL
+            self.svg.insert(0, layer)
+            return layer
+        for child in list(self.layer):
+            self.layer.remove(child)
+        return self.layer
+
+    def cleanup(self, layer, design_clips, design_group=None):
+        """stores the metadata on the layer and removes the previous clip paths and
+        design groups which are not used anymore"""
+        clip_ids = [
+            clip.get_id() for clip in design_clips if isinstance(clip, ClipPath)
+        ]
+        layer.set("data-bookart-clips", " ".join(clip_ids) if clip_ids else None)
+        layer.set(
+            "data-bookart-design",
+            design_group.get_id() if design_group is not None else None,
+        )
+        used = self.referenced_clips(layer) + list(design_clips) + [design_group]
+        previous = self.design_clips + self.page_clips + [self.design_group]
+        for element in previous:
+            if element is None or element in used:
+                continue
+            parent = element.getparent()
+            if parent is not None:
+                parent.remove(element)
+
+
+class Stage:  # pylint: disable=too-few-public-methods
+    """Time, memory and counts of one processing stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.time = 0.0
+        # None if the memory isn't measured
+        self.peak_memory = None
+        self.counts = {}
+
+    def count(self, **counts):
+        """records element counts"""
+        self.counts.update(counts)
+
+    def to_dict(self):
+        """returns the stage as a dictionary"""
+        return {
+            "name": self.name,
+            "time": self.time,
+            "peak_memory": self.peak_memory,
+            "counts": self.counts,
+        }
+
+
+class Instrumentation:
+    """Records wall time, peak memory and counts of the processing stages
+    Does nothing (and costs nothing) if not enabled
+
+    Memory tracing slows the stages down several times, so the peak memory is only
+    measured if requested (the times of such a run are not comparable). Tracing is
+    only on within the measured stages.
+    """
+
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """context manager which measures the enclosed stage"""
+        stage = Stage(name)
+        if not self.enabled:
+            yield stage
+            return
+        # tracing of an enclosing stage (or of the caller) continues
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.time = time.perf_counter() - start
+            if self.memory:
+                stage.peak_memory = tracemalloc.get_traced_memory()[1] - memory_start
+            if tracing:
+                tracemalloc.stop()
+            self.stages.append(stage)
+
+    @staticmethod
+    def path_segments(elements):
+        """returns the number of path segments of the given elements"""
+        return sum(len(element.path) for element in elements)
+
+    def summary(self):
+        """returns a table of all stages"""
+        lines = [f"{'stage':16}{'time (ms)':>11}{'peak memory (kB)':>18}  counts"]
+        for stage in self.stages:
+            counts = ", ".join(f"{key}={value}" for key, value in stage.counts.items())
+            memory = "-"
+            if stage.peak_memory is not None:
+                memory = f"{stage.peak_memory / 1024:.1f}"
+            lines.append(
+                f"{stage.name:16}{stage.time * 1000:11.2f}" f"{memory:>18}  {counts}"
+            )
+        total = sum(stage.time for stage in self.stages)
+        lines.append(f"{'total':16}{total * 1000:11.2f}")
+        return "\n".join(lines)
+
+    def save(self, file_name):
+        """writes all stages to a json file"""
+        with open(file_name, "w", encoding="utf-8") as stream:
+            json.dump({"stages": [stage.to_dict() for stage in self.stages]}, stream)
+
+
 class Bookart(EffectExtension):
     """EffectExtension to generate and colorize parallel vertical lines"""
 
     def __init__(self, *args, **kwargs):
         EffectExtension.__init__(self, *args, **kwargs)
 
-        self.settings = {}
+        self.settings = None
+        self.stats = Instrumentation()
 
     def add_arguments(self, pars):
         # tabs
@@ -415,37 +2332,73 @@ class Bookart(EffectExtension):
         pars.add_argument("--colors-tab", type=str, default=None, dest="layout_tab")
         # book settings
         pars.add_argument(
-            "--first_page", type=int, default=0, help="First even page number"
+            "--first_page",
+            type=int,
+            default=Settings.DEFAULTS["first_page"],
+            help="First even page number",
+        )
+        pars.add_argument(
+            "--last_page",
+            type=int,
+            default=Settings.DEFAULTS["last_page"],
+            help="Last even page number",
+        )
+        pars.add_argument(
+            "--pages_before",
+            type=int,
+            default=Settings.DEFAULTS["pages_before"],
+            help="Pages before design",
         )
         pars.add_argument(
-            "--last_page", type=int, default=250, help="Last even page number"
+            "--pages_after",
+            type=int,
+            default=Settings.DEFAULTS["pages_after"],
+            help="Pages after design",
         )
         pars.add_argument(
-            "--pages_before", type=int, default=0, help="Pages before design"
+            "--book_height",
+            type=float,
+            default=Settings.DEFAULTS["book_height"],
+            help="Book height",
         )
         pars.add_argument(
-            "--pages_after", type=int, default=0, help="Pages after design"
+            "--line_distance",
+            type=float,
+            default=Settings.DEFAULTS["line_distance"],
+            help="Distance between lines",
         )
-        pars.add_argument("--book_height", type=float, default=250, help="Book height")
         pars.add_argument(
-            "--line_distance", type=float, default=1.5, help="Distance between lines"
+            "--margin_bottom",
+            type=float,
+            default=Settings.DEFAULTS["margin_bottom"],
+            help="Margin to bottom",
         )
         pars.add_argument(
-            "--margin_bottom", type=float, default=0.0, help="Margin to bottom"
+            "--font_size",
+            type=float,
+            default=Settings.DEFAULTS["font_size"],
+            help="Font size",
         )
-        pars.add_argument("--font_size", type=float, default=4, help="Font size")
         pars.add_argument(
-            "--stroke_width", type=float, default=0.265, help="Stroke width"
+            "--stroke_width",
+            type=float,
+            default=Settings.DEFAULTS["stroke_width"],
+            help="Stroke width",
         )
         pars.add_argument("--units", type=str, default="mm", help="Units")
         # output settings
         pars.add_argument(
             "--document_format",
             type=str,
-            default="a4",
+            default=Settings.DEFAULTS["document_format"],
             help="Sets output document format and splits design to fit pages.",
         )
-        pars.add_argument("--page_margins", type=float, default=1, help="Page margins")
+        pars.add_argument(
+            "--page_margins",
+            type=float,
+            default=Settings.DEFAULTS["page_margins"],
+            help="Page margins",
+        )
         pars.add_argument(
             "--margin_unit", type=str, default="mm", help="Page margin unit"
         )
@@ -456,7 +2409,7 @@ class Bookart(EffectExtension):
         pars.add_argument(
             "--keep_pattern_color",
             type=Boolean,
-            default=False,
+            default=Settings.DEFAULTS["keep_pattern_color"],
             help="Pattern: keep original color",
         )
         pars.add_argument(
@@ -465,71 +2418,462 @@ class Bookart(EffectExtension):
             default=False,
             help="Add bottom line for book aligning",
         )
+        pars.add_argument(
+            "--pack_pages",
+            type=Boolean,
+            default=False,
+            help="Pack the line groups of the book onto as few document pages as "
+            "possible (the pages of one design only)",
+        )
+        pars.add_argument(
+            "--sheets",
+            type=str,
+            default="",
+            help="Generate only these document pages, e.g. 40-60 (empty: all pages)",
+        )
+        pars.add_argument(
+            "--shard",
+            type=str,
+            default="",
+            help="Generate only one of several equal parts of the pages, "
+            "e.g. 2/4 (second of four)",
+        )
+        pars.add_argument(
+            "--clip_method",
+            type=str,
+            choices=Settings.CLIP_METHODS,
+            default=Settings.DEFAULTS["clip_method"],
+            help="Clip lines with clip paths (clip_path), clip paths cropped to each "
+            "page (page_clip_path), geometrically (scanline) or with a low detail "
+            "bitmap for previews (raster)",
+        )
+        pars.add_argument(
+            "--keep_design",
+            type=Boolean,
+            default=Settings.DEFAULTS["keep_design"],
+            help="Leave the design in place, the clips reference it (use elements)",
+        )
+        pars.add_argument(
+            "--flatness",
+            type=float,
+            default=DesignGeometry.FLATNESS,
+            help="Tolerance for flattening curves of the design (document units)",
+        )
+        pars.add_argument(
+            "--simplify",
+            type=float,
+            default=Settings.DEFAULTS["simplify"],
+            help="Tolerance for simplifying the flattened design (0: off)",
+        )
+        pars.add_argument(
+            "--preview_pixel_size",
+            type=float,
+            default=0.5,
+            help="Pixel height of the raster preview",
+        )
+        pars.add_argument(
+            "--preview_time",
+            type=float,
+            default=5,
+            help="Time budget (seconds) for rasterizing the design in the raster preview",
+        )
+        pars.add_argument(
+            "--measurements_file",
+            type=str,
+            default="",
+            help="Export the fold zones of each page to this csv or json file",
+        )
+        pars.add_argument(
+            "--min_gap",
+            type=float,
+            default=0.0,
+            help="Merge fold zones which are closer than this value",
+        )
+        pars.add_argument(
+            "--compact",
+            type=Boolean,
+            default=False,
+            help="Write short relative path data and merged labels",
+        )
+        pars.add_argument(
+            "--precision",
+            type=int,
+            default=3,
+            help="Decimals of the coordinates in compact output",
+        )
+        pars.add_argument(
+            "--pages_dir",
+            type=str,
+            default="",
+            help="Write each page into a standalone svg file in this folder "
+            "instead of adding the pages to the document",
+        )
+        pars.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Worker processes which generate the pages (0: one per cpu)",
+        )
+        pars.add_argument(
+            "--cache_dir",
+            type=str,
+            default="",
+            help="Cache the design geometry in this folder (empty: no cache)",
+        )
+        pars.add_argument(
+            "--cache_size",
+            type=float,
+            default=100,
+            help="Maximum size of the geometry cache in MB",
+        )
+        pars.add_argument(
+            "--stats",
+            type=Boolean,
+            default=False,
+            help="Print time, memory and counts of each processing stage to stderr",
+        )
+        pars.add_argument(
+            "--stats_file",
+            type=str,
+            default="",
+            help="Write time, memory and counts of each processing stage to this json file",
+        )
+        pars.add_argument(
+            "--stats_memory",
+            type=Boolean,
+            default=False,
+            help="Also measure the peak memory of each stage (slows the stages down)",
+        )
+        pars.add_argument(
+            "--profile_file",
+            type=str,
+            default="",
+            help="Run with cProfile and dump the profile to this file",
+        )
 
     def effect(self):
-        total_pages = (self.options.last_page - self.options.first_page) / 2
-        design_pages = (
-            total_pages - self.options.pages_before - self.options.pages_after
-        )
-
-        self.settings = {
-            "first_page": self.options.first_page,
-            "last_page": self.options.last_page,
-            "pages_before": self.options.pages_before,
-            "pages_after": self.options.pages_after,
-            "total_pages": total_pages,
-            "design_pages": design_pages,
-            "document_format": self.options.document_format,
-            "page_margins": self.convert_unit(
-                self.options.page_margins, self.options.margin_unit
-            ),
-            "font_size": self.convert_unit(self.options.font_size),
-            "book_height": self.convert_unit(self.options.book_height),
-            "line_distance": max(0.1, self.convert_unit(self.options.line_distance)),
-            "margin_bottom": self.convert_unit(self.options.margin_bottom),
-            "stroke_width": self.convert_unit(self.options.stroke_width),
-            "design_color": self.options.color_pattern,
-            "highlight_colors": [
-                self.options.color_background,
-                self.options.color_highlight2,
-                self.options.color_highlight1,
-            ],
-            "keep_pattern_color": self.options.keep_pattern_color,
-        }
+        self.stats = Instrumentation(
+            bool(self.options.stats or self.options.stats_file),
+            self.options.stats_memory,
+        )
+        if self.options.profile_file:
+            profile = cProfile.Profile()
+            profile.runcall(self.generate)
+            profile.dump_stats(self.options.profile_file)
+        else:
+            self.generate()
+
+        if self.options.stats:
+            self.msg(self.stats.summary())
+        if self.options.stats_file:
+            self.stats.save(self.options.stats_file)
+
+    def generate(self):
+        """generates the book art pattern"""
+        stats = self.stats
+        with stats.stage("settings"):
+            try:
+                self.settings = self.get_settings()
+            except ValueError as error:
+                raise AbortExtension(str(error)) from error
 
         # pages
-        pages = Pages(self.svg, self.settings)
+        with stats.stage("pages"):
+            pages = Pages(self.svg, self.settings)
 
         # group, scale and clip design
         design = Design(self.svg, self.settings)
-        design.elements_to_pattern_groups()
-        design.design_to_group()
-        design.scale()
-        bbox = design.bbox()
+        with stats.stage("elements") as stage:
+            previous = PreviousOutput(self.svg)
+            previous.release_design()
+            if self.settings.keep_design:
+                previous.restore_design()
+            elements = design.elements(
+                previous.excluded(), previous.design_containers()
+            )
+            stage.count(elements=len(elements))
+            stage.count(
+                **{f"skipped_{key}": value for key, value in design.skipped.items()}
+            )
+            if stats.enabled:
+                stage.count(path_segments=Instrumentation.path_segments(elements))
+        cache = self.geometry_cache()
+        cache_key = cache_entry = None
+        with stats.stage("pattern_groups") as stage:
+            if cache is not None:
+                cache_key = design.fingerprint(elements)
+                cache_entry = cache.load(cache_key)
+                stage.count(cache_hit=cache_entry is not None)
+            if cache_entry is None:
+                design.elements_to_pattern_groups(elements)
+            else:
+                design.restore(elements, cache_entry)
+            design.design_to_group()
+            stage.count(pattern_groups=len(design))
+        with stats.stage("scale"):
+            design.scale()
+        with stats.stage("bbox"):
+            bbox = design.bbox()
 
         # generate design clips
-        design_clips = []
-        for pattern in design.pattern_groups:
-            clip = pattern.to_clip_path()
-            design_clips.append(clip)
+        with stats.stage("clips") as stage:
+            design_clips = []
+            skipped = 0
+            if self.settings.clip_method == "raster":
+                design_clips, skipped = design.raster_clips(
+                    self.convert_unit(self.options.preview_pixel_size),
+                    self.options.preview_time,
+                )
+                stage.count(skipped_elements=skipped)
+            for i, pattern in enumerate(design.pattern_groups):
+                if self.settings.clip_method == "raster":
+                    break
+                if self.settings.clip_method == "scanline":
+                    clip = design.scanline_clip([pattern])
+                elif self.settings.clip_method == "page_clip_path":
+                    clip = design.page_clip(pattern)
+                else:
+                    clip = pattern.to_clip_path(previous.design_clip(i))
+                design_clips.append(clip)
+            design_group = None
+            if (
+                self.settings.clip_method != "clip_path"
+                and not self.settings.keep_design
+            ):
+                # keep the design in the document for the next run
+                design_group = design.group_to_defs(previous.design_group)
+            stage.count(clips=len(design_clips))
+
+        # the raster preview doesn't compute the full geometry
+        if (
+            cache is not None
+            and cache_entry is None
+            and bbox is not None
+            and self.settings.clip_method != "raster"
+        ):
+            with stats.stage("cache"):
+                cache.store(cache_key, design.cache_entry())
 
         # get number of pages and lines per page
         lines_per_page = pages.num_lines_per_page
         num_pages = pages.num_pages
 
-        # generate lines
-        lines = Lines(
-            design.colors, lines_per_page, num_pages, bbox, design_clips, self.settings
+        # generate lines, pages of the previous run with the same content are reused
+        # preview pages depend on the time budget, they are never reused
+        with stats.stage("lines") as stage:
+            page_key = None
+            if self.settings.clip_method != "raster":
+                settings_key = self.settings_key(design, lines_per_page, num_pages)
+                page_key = partial(design.page_key, settings_key)
+            try:
+                page_range = self.page_range(num_pages)
+            except ValueError as error:
+                raise AbortExtension(str(error)) from error
+            lines = Lines(
+                design.colors,
+                lines_per_page,
+                num_pages,
+                bbox,
+                design_clips,
+                self.settings,
+                page_key=page_key,
+                previous_pages=previous.pages,
+                page_range=page_range,
+            )
+            if self.options.bottom_line:
+                lines.add_bottom_lines()
+            stage.count(pages=len(lines.pages), reused_pages=len(lines.reused))
+
+        if self.settings.clip_method == "raster" and design_clips:
+            with stats.stage("preview") as stage:
+                stage.count(cuts=self.preview_report(lines, design_clips, skipped))
+
+        if self.options.pages_dir:
+            with stats.stage("write_pages") as stage:
+                self.write_pages(pages, lines, design_clips)
+                stage.count(files=len(lines.pages))
+        else:
+            self.insert_pages(pages, lines, previous, design_clips, design_group)
+
+        if self.options.measurements_file:
+            with stats.stage("measurements"):
+                self.save_measurements(design, lines)
+
+    def insert_pages(
+        self, pages, lines, previous, design_clips, design_group
+    ):  # pylint: disable=too-many-arguments
+        """generates the pages and inserts the lines into the document"""
+        stats = self.stats
+        with stats.stage("generate_pages"):
+            layer = previous.new_layer()
+            extents = None
+            if self.options.pack_pages:
+                extents = [lines.page_extents(page) for page in lines.pages]
+            pages.generate_pages_with_lines(lines.pages, extents)
+
+        # generate the svg elements and insert them into the document
+        with stats.stage("insert") as stage:
+            lines.add_to_document(layer, self.processes())
+            previous.cleanup(layer, design_clips, design_group)
+            if stats.enabled:
+                children = [child for group in lines.line_groups for child in group]
+                line_paths = [
+                    path for path in children if isinstance(path, PathElement)
+                ]
+                labels = [text for text in children if isinstance(text, TextElement)]
+                stage.count(
+                    path_segments=Instrumentation.path_segments(line_paths),
+                    labels=sum(len(text) for text in labels),
+                    path_bytes=sum(len(path.get("d")) for path in line_paths),
+                )
+                if lines.encoder is not None:
+                    stage.count(path_bytes_verbose=lines.path_data_size())
+
+    def preview_report(self, lines, design_clips, skipped):
+        """shows the estimated number of cuts of the raster preview"""
+        design_raster = design_clips[0].union(design_clips[1:])
+        positions = np.concatenate([page.positions for page in lines.pages])
+        cuts = design_raster.count_cuts(
+            positions, lines.line_bbox["top"], lines.line_bbox["bottom"]
+        )
+        message = f"Preview: about {cuts} cuts on {len(positions)} pages"
+        if skipped:
+            message += f" ({skipped} small elements skipped, time budget exceeded)"
+        self.msg(message)
+        return cuts
+
+    def write_pages(self, pages, lines, design_clips):
+        """writes every page into a standalone svg file, one page at a time"""
+        for page in lines.pages:
+            page.translate = pages.center(page.bbox)
+        writer = PageWriter(self.options.pages_dir, self.svg, pages.width, pages.height)
+        shared_clips = [clip for clip in design_clips if isinstance(clip, ClipPath)]
+        writer.write_all(
+            lines.iter_page_groups(self.processes()),
+            shared_clips,
+            [page.index for page in lines.pages],
         )
-        if self.options.bottom_line:
-            lines.add_bottom_lines()
 
-        # insert into document
-        layer = Layer()
-        layer.label = "Book Art"
-        self.svg.insert(0, layer)
-        lines.add_to_document(layer)
-        pages.generate_pages_with_lines(lines.line_groups)
+    def page_range(self, num_pages):
+        """returns the range of the document pages (indices) to generate, selected by
+        the sheet range and the shard (None: all pages)
+        raises a ValueError for invalid or empty selections"""
+        sheets = self.options.sheets.strip()
+        shard = self.options.shard.strip()
+        if not sheets and not shard:
+            return None
+        if self.options.pack_pages:
+            raise ValueError(
+                "Sheet ranges and shards can't be combined with shared document pages"
+            )
+        start, stop = 0, num_pages
+        if sheets:
+            match = re.fullmatch(r"(\d+)(?:\s*-\s*(\d*))?", sheets)
+            if match is None:
+                raise ValueError(f"Invalid sheet range '{sheets}' (e.g. 40-60)")
+            first = int(match.group(1))
+            last = match.group(2)
+            last = first if last is None else int(last) if last else num_pages
+            if first < 1 or last < first:
+                raise ValueError(f"Invalid sheet range '{sheets}' (e.g. 40-60)")
+            if first > num_pages:
+                raise ValueError(f"The pattern has only {num_pages} sheets")
+            start, stop = first - 1, min(last, num_pages)
+        if shard:
+            match = re.fullmatch(r"(\d+)\s*/\s*(\d+)", shard)
+            if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+                raise ValueError(f"Invalid shard '{shard}' (e.g. 2/4)")
+            index, num_shards = int(match.group(1)) - 1, int(match.group(2))
+            # contiguous shards of (almost) the same size
+            size = stop - start
+            start, stop = (
+                start + size * index // num_shards,
+                start + size * (index + 1) // num_shards,
+            )
+            if start == stop:
+                raise ValueError(f"The shard {shard} of {size} sheets is empty")
+        return range(start, stop)
+
+    def processes(self):
+        """returns the number of worker processes for the pages (None: all cpus)"""
+        return self.options.processes or None
+
+    def has_changed(self, ret):
+        # the pages were written to separate files, the document stays as it is
+        if self.options.pages_dir:
+            return False
+        return EffectExtension.has_changed(self, ret)
+
+    def get_settings(self):
+        """returns the settings, lengths are converted to user units
+        raises a ValueError for settings which can't produce a pattern"""
+        page_width, page_height = Pages.document_size(
+            self.svg, self.options.document_format
+        )
+        return Settings(
+            first_page=self.options.first_page,
+            last_page=self.options.last_page,
+            pages_before=self.options.pages_before,
+            pages_after=self.options.pages_after,
+            document_format=self.options.document_format,
+            page_width=page_width,
+            page_height=page_height,
+            page_margins=self.convert_unit(
+                self.options.page_margins, self.options.margin_unit
+            ),
+            font_size=self.convert_unit(self.options.font_size),
+            book_height=self.convert_unit(self.options.book_height),
+            line_distance=max(0.1, self.convert_unit(self.options.line_distance)),
+            margin_bottom=self.convert_unit(self.options.margin_bottom),
+            stroke_width=self.convert_unit(self.options.stroke_width),
+            design_color=self.options.color_pattern,
+            highlight_colors=(
+                self.options.color_background,
+                self.options.color_highlight2,
+                self.options.color_highlight1,
+            ),
+            keep_pattern_color=self.options.keep_pattern_color,
+            clip_method=self.options.clip_method,
+            keep_design=self.options.keep_design,
+            flatness=self.options.flatness,
+            simplify=self.options.simplify,
+            precision=self.options.precision if self.options.compact else None,
+            unit_size=self.convert_unit(1),
+        )
+
+    def settings_key(self, design, lines_per_page, num_pages):
+        """returns a hash of the settings and design properties all pages depend on"""
+        bbox = design.bbox()
+        settings = dict(
+            self.settings.to_dict(),
+            version=PreviousOutput.VERSION,
+            colors=[str(color) for color in design.colors],
+            bbox=[bbox.left, bbox.right, bbox.top, bbox.bottom] if bbox else None,
+            scale_factor=design.scale_factor,
+            lines_per_page=lines_per_page,
+            num_pages=num_pages,
+            bottom_line=self.options.bottom_line,
+        )
+        # the pages don't depend on where the design is kept
+        del settings["keep_design"]
+        settings = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    def save_measurements(self, design, lines):
+        """exports the fold zones of the scaled design for every page"""
+        fold_zones = lines.fold_zones(
+            design.scanline_clip(), self.convert_unit(self.options.min_gap)
+        )
+        measurements = Measurements(
+            fold_zones, self.options.units, self.settings.unit_size
+        )
+        measurements.save(self.options.measurements_file)
+
+    def geometry_cache(self):
+        """returns the geometry cache (None if disabled)"""
+        if not self.options.cache_dir:
+            return None
+        return GeometryCache(self.options.cache_dir, self.options.cache_size * 1e6)
 
     def convert_unit(self, value, unit=None):
         """convert units (input values)"""
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# coding=utf-8
+#
+# Copyright (C) 2022-2023 Kaalleen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+"""
+Headless batch generation of book art patterns.
+
+Runs the Book Art extension for every combination of input designs and option sets
+listed in a json manifest:
+
+    {
+        "inputs": ["owl.svg", "cat.svg"],
+        "options": {
+            "small": {"last_page": 300, "book_height": 180},
+            "letter": ["--document_format=letter", "--line_distance=2"]
+        }
+    }
+
+Relative input paths are relative to the manifest. Option sets use the same options
+as the extension (without the leading dashes when given as a dictionary).
+Outputs are written to <output dir>/<input name>__<option set name>.svg.
+
+    python3 bookart_batch.py manifest.json --output-dir out --processes 4
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from inkex import load_svg
+
+from bookart import Bookart
+
+# parsed input documents of this (worker) process
+_DOCUMENTS = {}
+
+
+class BatchBookart(Bookart):
+    """Bookart extension working on a copy of an already parsed document"""
+
+    def __init__(self, document):
+        Bookart.__init__(self)
+        self.parsed_document = document
+
+    def load(self, stream):
+        document = copy.deepcopy(self.parsed_document)
+        self.original_document = self.parsed_document
+        self.svg = document.getroot()
+        self.svg.selection.set(*self.options.ids)
+        return document
+
+    def has_changed(self, ret):
+        # always write the output, comparing the documents is expensive
+        return True
+
+
+class Job:  # pylint: disable=too-few-public-methods
+    """One input design with one option set"""
+
+    def __init__(self, input_file, name, args, output_file):
+        self.input_file = input_file
+        self.name = name
+        self.args = args
+        self.output_file = output_file
+
+    def __repr__(self):
+        return f"Job({self.input_file}, {self.name})"
+
+
+def option_args(options):
+    """converts an option set (dict or list) into command line arguments"""
+    if isinstance(options, dict):
+        return [f"--{key}={value}" for key, value in options.items()]
+    return [str(arg) for arg in options]
+
+
+def read_manifest(manifest_file, output_dir):
+    """returns the list of jobs defined in the manifest"""
+    with open(manifest_file, encoding="utf-8") as stream:
+        manifest = json.load(stream)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    option_sets = manifest.get("options", {"default": {}})
+    jobs = []
+    for input_file in manifest["inputs"]:
+        input_file = os.path.join(base_dir, input_file)
+        stem = os.path.splitext(os.path.basename(input_file))[0]
+        for name, options in option_sets.items():
+            output_file = os.path.join(output_dir, f"{stem}__{name}.svg")
+            jobs.append(Job(input_file, name, option_args(options), output_file))
+    return jobs
+
+
+def job_result(job, status, error=None, run_time=0.0):
+    """returns the result dictionary of a job"""
+    result = {"input": job.input_file, "options": job.name, "output": job.output_file}
+    result.update({"status": status, "time": run_time})
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def run_job(job):
+    """runs a single job, returns a result dictionary (never raises)"""
+    start = time.perf_counter()
+    try:
+        document = _DOCUMENTS.get(job.input_file)
+        if document is None:
+            document = load_svg(job.input_file)
+            _DOCUMENTS[job.input_file] = document
+        extension = BatchBookart(document)
+        extension.run(job.args + [job.input_file], output=job.output_file)
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+        message = "".join(traceback.format_exception_only(type(error), error))
+        return job_result(job, "failed", message, time.perf_counter() - start)
+    return job_result(job, "ok", run_time=time.perf_counter() - start)
+
+
+def run_jobs(jobs, processes=None, report=print):
+    """runs all jobs in a process pool and returns the results in job order
+    jobs of the same input are submitted together, so that workers can reuse the
+    parsed document"""
+    results = {}
+    if processes == 1:
+        for job in sorted(jobs, key=lambda job: job.input_file):
+            results[id(job)] = run_job(job)
+            report(format_result(results[id(job)]))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {
+                executor.submit(run_job, job): job
+                for job in sorted(jobs, key=lambda job: job.input_file)
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    results[id(job)] = future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    # the worker process died
+                    results[id(job)] = job_result(job, "failed", repr(error))
+                report(format_result(results[id(job)]))
+    return [results[id(job)] for job in jobs]
+
+
+def format_result(result):
+    """returns a one line summary of a job result"""
+    line = f"{result['status']:6} {result['time']:7.2f}s  {result['output']}"
+    if result["status"] != "ok":
+        line += f"\n       {result['error'].strip()}"
+    return line
+
+
+def main(args=None):
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("manifest", help="json manifest with inputs and option sets")
+    parser.add_argument("--output-dir", default="bookart_output")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="worker processes (default: cpus)"
+    )
+    parser.add_argument("--report", help="write the job results to this json file")
+    options = parser.parse_args(args)
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    jobs = read_manifest(options.manifest, options.output_dir)
+
+    start = time.perf_counter()
+    results = run_jobs(jobs, options.processes)
+    failed = [result for result in results if result["status"] != "ok"]
+    print(
+        f"{len(results) - len(failed)} of {len(results)} jobs finished "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    if options.report:
+        with open(options.report, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
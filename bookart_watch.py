@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# coding=utf-8
+#
+# Copyright (C) 2022-2023 Kaalleen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+"""
+Regenerates book art patterns whenever the source svg files change.
+
+Watches an svg file or a folder of svg files. The interpreter and the extension
+options stay loaded, a change only reloads the changed design and rewrites its
+output (<output dir>/<input name>.svg). Options which are not listed below are
+passed to the extension.
+
+    python3 bookart_watch.py design.svg --output-dir out --last_page=300
+    python3 bookart_watch.py designs/ --output-dir out --interval 0.5 --debounce 1
+"""
+
+import argparse
+import os
+import sys
+import time
+import traceback
+
+from inkex import load_svg
+
+from bookart import Bookart
+
+
+class WatchBookart(Bookart):
+    """Bookart extension which parses its options once and is run for many files"""
+
+    def __init__(self, args):
+        Bookart.__init__(self)
+        self.parse_arguments(args)
+
+    def regenerate(self, input_file, output_file):
+        """runs the extension on the input file and writes the output file"""
+        self.options.input_file = input_file
+        self.options.output = output_file
+        try:
+            self.load_raw()
+            self.save_raw(self.effect())
+        finally:
+            self.clean_up()
+            self.file_io = None
+
+    def load(self, stream):
+        # no backup of the document, has_changed() doesn't compare
+        document = load_svg(stream)
+        self.svg = document.getroot()
+        self.svg.selection.set(*self.options.ids)
+        return document
+
+    def has_changed(self, ret):
+        # always write the output, comparing the documents is expensive
+        return True
+
+
+class Watcher:
+    """Polls the modification time and size of the watched svg files
+
+    A changed file is reported once it hasn't changed for the debounce time, so that
+    rapid saves (or a file which is still being written) trigger only one run.
+    """
+
+    def __init__(self, path, debounce=0.5, clock=time.monotonic):
+        self.path = path
+        self.debounce = debounce
+        self.clock = clock
+        # file signatures of the last regeneration
+        self.seen = {}
+        # changed files: (signature, time of the last change)
+        self.pending = {}
+
+    def files(self):
+        """returns the watched svg files"""
+        if not os.path.isdir(self.path):
+            return [self.path]
+        files = []
+        for name in sorted(os.listdir(self.path)):
+            file_name = os.path.join(self.path, name)
+            if name.endswith(".svg") and os.path.isfile(file_name):
+                files.append(file_name)
+        return files
+
+    @staticmethod
+    def signature(file_name):
+        """returns the modification time and size of a file (None if missing)"""
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def poll(self):
+        """returns the changed files which are ready to be regenerated
+        with the time their last change was noticed"""
+        now = self.clock()
+        ready = []
+        for file_name in self.files():
+            signature = self.signature(file_name)
+            if signature is None or signature == self.seen.get(file_name):
+                self.pending.pop(file_name, None)
+                continue
+            pending = self.pending.get(file_name)
+            if pending is None or pending[0] != signature:
+                self.pending[file_name] = (signature, now)
+            elif now - pending[1] >= self.debounce:
+                ready.append((file_name, pending[1]))
+                self.seen[file_name] = signature
+                del self.pending[file_name]
+        return ready
+
+
+def output_file(input_file, output_dir):
+    """returns the output file of an input file"""
+    return os.path.join(output_dir, os.path.basename(input_file))
+
+
+def regenerate(extension, input_file, output_dir, changed=None, report=print):
+    """regenerates the output of a changed file and reports the latency
+    returns True on success (never raises)"""
+    start = time.monotonic()
+    output = output_file(input_file, output_dir)
+    try:
+        extension.regenerate(input_file, output)
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-except
+        message = "".join(traceback.format_exception_only(type(error), error))
+        report(
+            f"failed {time.monotonic() - start:7.2f}s  {input_file}\n       {message}"
+        )
+        return False
+    now = time.monotonic()
+    line = f"ok     {now - start:7.2f}s  {output}"
+    if changed is not None:
+        line += f"  ({now - changed:.2f}s after the change)"
+    report(line)
+    return True
+
+
+def watch(
+    watcher, extension, output_dir, interval=0.5, report=print, cycles=None
+):  # pylint: disable=too-many-arguments
+    """polls the watcher and regenerates the changed files
+    runs forever, unless a number of polling cycles is given"""
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        for input_file, changed in watcher.poll():
+            regenerate(extension, input_file, output_dir, changed, report)
+        cycle += 1
+        time.sleep(interval)
+
+
+def main(args=None):
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("path", help="svg file or folder with svg files")
+    parser.add_argument("--output-dir", default="bookart_output")
+    parser.add_argument(
+        "--interval", type=float, default=0.5, help="polling interval (seconds)"
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        help="wait until a file didn't change for this time (seconds)",
+    )
+    options, extension_args = parser.parse_known_args(args)
+
+    watched_dir = options.path
+    if not os.path.isdir(watched_dir):
+        watched_dir = os.path.dirname(watched_dir) or "."
+    if os.path.abspath(watched_dir) == os.path.abspath(options.output_dir):
+        parser.error("the output folder must not be the watched folder")
+
+    os.makedirs(options.output_dir, exist_ok=True)
+    extension = WatchBookart(extension_args)
+    watcher = Watcher(options.path, options.debounce)
+    print(f"watching {options.path} (ctrl+c to stop)")
+    try:
+        watch(watcher, extension, options.output_dir, options.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+# coding=utf-8
+"""
+Benchmarks for the bookart extension
+
+Synthetic designs (many paths, colors, nested transforms and curves) are processed
+with extreme settings, the comparison cases of the tests run on the test document.
+Time and memory of each processing stage are compared to the stored baseline in
+data/benchmarks/baseline.json. Every run starts with cold caches (the memoized
+design geometry is cleared). The times are compared relative to a fixed workload
+timed next to the runs, so that a busy machine doesn't show up as regression.
+
+The baseline records the machine, the Python and the numpy version it was measured
+with, it is only compared in the same environment.
+
+The benchmarks only run as part of the test suite if BOOKART_BENCHMARK is set.
+Run them directly (and update the baseline) with:
+
+    python -m tests.test_benchmark [--update-baseline] [--threshold 0.5] [case ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import unittest
+from io import BytesIO
+
+import numpy as np
+
+from inkex.tester import TestCase
+
+from bookart import Bookart, _element_polygons
+from tests import test_bookart, test_golden
+
+BASELINE = os.path.join(
+    os.path.dirname(__file__), "data", "benchmarks", "baseline.json"
+)
+
+# allowed slow down compared to the baseline (0.5 = 50%)
+THRESHOLD = 0.5
+# stages faster than this (seconds) are too noisy to be compared
+MIN_TIME = 0.02
+
+CASES = {
+    "default": ({"num_paths": 300}, []),
+    "dense_lines": (
+        {"num_paths": 100},
+        ["--line_distance=0.1", "--first_page=2", "--last_page=5000"],
+    ),
+    "sharded": (
+        {"num_paths": 100},
+        [
+            "--line_distance=3",
+            "--first_page=2",
+            "--last_page=5000",
+            "--clip_method=scanline",
+            "--shard=3/8",
+        ],
+    ),
+    "many_colors": (
+        {"num_paths": 400, "num_colors": 10},
+        ["--keep_pattern_color=true", "--bottom_line=true", "--last_page=1000"],
+    ),
+    "scanline": (
+        {"num_paths": 150, "num_colors": 4},
+        ["--clip_method=scanline", "--keep_pattern_color=true", "--last_page=1000"],
+    ),
+    # flattening: many distinct curved paths, few lines
+    "curves": (
+        {"num_paths": 2000},
+        ["--clip_method=scanline", "--line_distance=5", "--last_page=200"],
+    ),
+}
+# the comparison cases run on the test document (no synthetic design)
+CASES.update(
+    (f"comparison {name}", (None, args)) for name, args in test_golden.cases().items()
+)
+
+
+def synthetic_design(num_paths=500, num_colors=1, depth=3, seed=1):
+    """returns an svg document with random shapes in nested, transformed groups"""
+    rng = random.Random(seed)
+    colors = [f"#{rng.randrange(0x1000000):06x}" for _ in range(num_colors)]
+
+    def shape():
+        color = rng.choice(colors)
+        x, y = rng.uniform(10, 190), rng.uniform(10, 240)
+        size = rng.uniform(2, 15)
+        kind = rng.random()
+        if kind < 0.1:
+            return (
+                f'<rect x="{x}" y="{y}" width="{size}" height="{size * 1.5}" '
+                f'style="fill:{color}" />'
+            )
+        if kind < 0.2:
+            return f'<circle cx="{x}" cy="{y}" r="{size}" style="fill:{color}" />'
+        if kind < 0.3:
+            return (
+                f'<ellipse cx="{x}" cy="{y}" rx="{size}" ry="{size / 2}" '
+                f'style="fill:{color}" />'
+            )
+        path = f"M {x} {y}"
+        for _ in range(rng.randint(2, 6)):
+            points = " ".join(f"{rng.uniform(-size, size):.3f}" for _ in range(6))
+            path += f" c {points}"
+        path += f" a {size / 2} {size / 3} 30 0 1 {size / 2} {size / 2} z"
+        return f'<path d="{path}" style="fill:{color};stroke:none" />'
+
+    def transform():
+        return rng.choice(
+            [
+                f"translate({rng.uniform(-5, 5)},{rng.uniform(-5, 5)})",
+                f"rotate({rng.uniform(-10, 10)} 100 125)",
+                f"scale({rng.uniform(0.95, 1.05)})",
+                f"matrix(1 0 {rng.uniform(-0.1, 0.1)} 1 0 0)",
+            ]
+        )
+
+    def group(num, level):
+        if level == depth or num < 4:
+            return "".join(shape() for _ in range(num))
+        split = rng.randint(1, num - 1)
+        return (
+            f'<g transform="{transform()}">{group(split, level + 1)}</g>'
+            f'<g transform="{transform()}">{group(num - split, level + 1)}</g>'
+        )
+
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="200mm" height="250mm" '
+        f'viewBox="0 0 200 250">{group(num_paths, 0)}</svg>'
+    )
+
+
+def calibration():
+    """returns the time of a fixed workload, the timings of the cases are compared
+    relative to it (a busy machine slows down all stages alike)"""
+    points = np.random.default_rng(1).random((20000, 2))
+    start = time.perf_counter()
+    for _ in range(10):
+        np.sort(points, axis=0)
+        sum(x * y for x, y in points.tolist())
+    return time.perf_counter() - start
+
+
+def run_case(name, repeat=3):
+    """runs a benchmark case, returns total time and stages of the fastest run
+    and the fastest calibration next to the runs (the peak memory of the stages is
+    measured in an additional run)"""
+    design, args = CASES[name]
+    with tempfile.TemporaryDirectory() as tempdir:
+        svg_file = test_bookart.SVG_FILE
+        stats_file = os.path.join(tempdir, "stats.json")
+        if design is not None:
+            svg_file = os.path.join(tempdir, "design.svg")
+            with open(svg_file, "w", encoding="utf-8") as stream:
+                stream.write(synthetic_design(**design))
+
+        def run(*extra_args):
+            # equal geometry of earlier runs would be taken from the memory
+            _element_polygons.cache_clear()
+            Bookart().run(
+                args + [f"--stats_file={stats_file}", *extra_args, svg_file],
+                output=BytesIO(),
+            )
+            with open(stats_file, encoding="utf-8") as stream:
+                return json.load(stream)["stages"]
+
+        best = None
+        calibrations = []
+        for _ in range(repeat):
+            calibrations.append(calibration())
+            stages = run()
+            result = {
+                "time": sum(stage["time"] for stage in stages),
+                "stages": {stage["name"]: {"time": stage["time"]} for stage in stages},
+            }
+            if best is None or result["time"] < best["time"]:
+                best = result
+        best["calibration"] = min(calibrations)
+        # memory tracing slows the stages down, it is measured in a separate run
+        for stage in run("--stats_memory=true"):
+            best["stages"][stage["name"]]["peak_memory"] = stage["peak_memory"]
+    return best
+
+
+def environment():
+    """returns the machine and versions the benchmarks run with"""
+    return {
+        "machine": platform.node(),
+        "processor": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def load_baseline():
+    """returns the stored baseline results (by case) if they were measured in this
+    environment, else None"""
+    if not os.path.isfile(BASELINE):
+        return None
+    with open(BASELINE, encoding="utf-8") as stream:
+        baseline = json.load(stream)
+    if baseline.get("environment") != environment():
+        return None
+    return baseline["cases"]
+
+
+def regressions(name, result, baseline, threshold=THRESHOLD):
+    """returns a list of measurements which are worse than the baseline"""
+    found = []
+    reference = baseline.get(name)
+    if reference is None:
+        return found
+    # the baseline times at the speed of the machine during the run
+    speed = result["calibration"] / reference["calibration"]
+    measurements = [("total", "time", result["time"], reference["time"] * speed)]
+    for stage, values in result["stages"].items():
+        if stage not in reference["stages"]:
+            continue
+        for key, scale in (("time", speed), ("peak_memory", 1)):
+            measurements.append(
+                (stage, key, values[key], reference["stages"][stage][key] * scale)
+            )
+    for stage, key, value, reference_value in measurements:
+        if key == "time" and max(value, reference_value) < MIN_TIME:
+            continue
+        if value > reference_value * (1 + threshold) and value > 0:
+            found.append(
+                f"{name}: {stage} {key} {value:.4g} > baseline {reference_value:.4g}"
+            )
+    return found
+
+
+def main(args=None):
+    """run benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description="bookart benchmarks")
+    parser.add_argument("cases", nargs="*", default=list(CASES))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args(args)
+
+    baseline = load_baseline()
+    if baseline is None:
+        print("No baseline for this machine and these versions, nothing is compared")
+        baseline = {}
+    failed = []
+    results = dict(baseline)
+    for name in options.cases:
+        result = run_case(name, options.repeat)
+        reference = baseline.get(name, {}).get("time")
+        compared = f" (baseline {reference:.3f}s)" if reference else ""
+        print(f"{name:14} {result['time']:8.3f}s{compared}")
+        for stage, values in result["stages"].items():
+            print(
+                f"    {stage:16} {values['time'] * 1000:10.1f} ms "
+                f"{values['peak_memory'] / 1024:10.1f} kB"
+            )
+        failed.extend(regressions(name, result, baseline, options.threshold))
+        results[name] = result
+
+    if options.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w", encoding="utf-8") as stream:
+            json.dump(
+                {"environment": environment(), "cases": results},
+                stream,
+                indent=1,
+                sort_keys=True,
+            )
+    elif failed:
+        print("\n".join(["Regressions:"] + failed))
+        return 1
+    return 0
+
+
+@unittest.skipUnless(os.environ.get("BOOKART_BENCHMARK"), "set BOOKART_BENCHMARK")
+class BenchmarkTest(TestCase):
+    """Compare the benchmark cases against the stored baseline"""
+
+    def test_benchmarks(self):
+        """no stage should be significantly slower than in the baseline"""
+        baseline = load_baseline()
+        if baseline is None:
+            self.skipTest("the baseline was measured in another environment")
+        failed = []
+        for name in CASES:
+            failed.extend(regressions(name, run_case(name), baseline))
+        self.assertFalse(failed, "\n".join(failed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
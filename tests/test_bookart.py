@@ -3,15 +3,78 @@
 Test the bookart extension
 """
 
+import csv
+import json
+import os
+import pickle
+import random
+import re
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+
+from inkex import Path, load_svg
 from inkex.tester import ComparisonMixin, TestCase
+from inkex.tester.filters import Compare
+
+from bookart import (
+    Bookart,
+    CompactEncoder,
+    Design,
+    DesignGeometry,
+    RasterClip,
+    Settings,
+    SheetPacker,
+)
+
+SVG_FILE = os.path.join(os.path.dirname(__file__), "data", "svg", "bookart.svg")
+
+
+def run_bookart(args, input_file=SVG_FILE):
+    """runs the extension with a fixed random seed (same element and clip ids in
+    every run), returns the output document (empty if nothing changed)"""
+    random.seed(1)
+    output = BytesIO()
+    Bookart().run(list(args) + [input_file], output=output)
+    return output.getvalue()
+
+
+def parse_svg(document):
+    """returns the root element of an svg document"""
+    return load_svg(BytesIO(document)).getroot()
 
-from bookart import Bookart
+
+def design_svg(shapes):
+    """returns the root element of a 100 x 100 document with the given shapes"""
+    return parse_svg(
+        b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">'
+        + shapes
+        + b"</svg>"
+    )
+
+
+def load_stages(file_name):
+    """returns the stages of a statistics file by name"""
+    with open(file_name, encoding="utf-8") as stream:
+        return {stage["name"]: stage for stage in json.load(stream)["stages"]}
+
+
+class CompareWithoutRerunData(Compare):
+    """Removes the metadata of re-runs (page hashes, clip and design ids on the layer),
+    the hashes change with every change of the geometry"""
+
+    @staticmethod
+    def filter(contents):
+        return re.sub(rb' data-bookart-[a-z]+="[^"]*"', b"", contents)
 
 
 class BookartTest(ComparisonMixin, TestCase):
     """Test bookart extension with comparisons"""
 
     effect_class = Bookart
+    compare_filters = [CompareWithoutRerunData()]
+    compare_filter_save = True
     comparisons = [
         (),
         (
@@ -64,5 +127,655 @@ class BookartTest(ComparisonMixin, TestCase):
             "--color_highlight2=#ebf400",
             "--color_background=#66ff88",
         ),
+        (
+            "--id=woodpecker",
+            "--first_page=-6",
+            "--last_page=100",
+            "--book_height=160",
+            "--clip_method=scanline",
+        ),
+        (
+            "--id=woodpecker",
+            "--first_page=6",
+            "--last_page=300",
+            "--line_distance=5",
+            "--clip_method=page_clip_path",
+        ),
+        (
+            "--id=woodpecker",
+            "--first_page=-6",
+            "--last_page=100",
+            "--book_height=160",
+            "--clip_method=scanline",
+            "--compact=true",
+            "--precision=2",
+        ),
     ]
     compare_file = "svg/bookart.svg"
+
+
+class BookartPreviewTest(ComparisonMixin, TestCase):
+    """Test the raster preview with comparisons (the cut estimate goes to stderr)"""
+
+    effect_class = Bookart
+    compare_filters = [CompareWithoutRerunData()]
+    compare_filter_save = True
+    stderr_protect = False
+    comparisons = [
+        (
+            "--id=woodpecker",
+            "--first_page=-6",
+            "--last_page=100",
+            "--book_height=160",
+            "--clip_method=raster",
+        ),
+    ]
+    compare_file = "svg/bookart.svg"
+
+
+class BookartMeasurementsTest(TestCase):
+    """Test the fold zone export"""
+
+    effect_class = Bookart
+    args = [
+        "--id=woodpecker",
+        "--first_page=-6",
+        "--last_page=100",
+        "--book_height=160",
+    ]
+
+    def test_csv(self):
+        """every page is listed, zones are within the book height"""
+        file_name = os.path.join(self.tempdir, "zones.csv")
+        self.assertEffect(
+            "svg", "bookart.svg", args=self.args + [f"--measurements_file={file_name}"]
+        )
+        with open(file_name, encoding="utf-8") as stream:
+            rows = list(csv.reader(stream))[1:]
+        self.assertEqual(rows[0], ["-6", "", "", ""])
+        self.assertEqual(rows[-1][0], "100")
+        self.assertEqual(len({row[0] for row in rows}), 54)
+        for row in (row for row in rows if row[1]):
+            self.assertLess(0, float(row[2]))
+            self.assertLess(float(row[2]), float(row[3]))
+            self.assertLess(float(row[3]), 160)
+
+    def test_json_min_gap(self):
+        """a large minimum gap merges all zones of a page"""
+        file_name = os.path.join(self.tempdir, "zones.json")
+        self.assertEffect(
+            "svg",
+            "bookart.svg",
+            args=self.args + [f"--measurements_file={file_name}", "--min_gap=200"],
+        )
+        with open(file_name, encoding="utf-8") as stream:
+            measurements = json.load(stream)
+        self.assertEqual(measurements["unit"], "mm")
+        self.assertEqual(len(measurements["pages"]), 54)
+        for page in measurements["pages"]:
+            self.assertLessEqual(len(page["zones"]), 1)
+
+
+class BookartStatsTest(TestCase):
+    """Test the processing stage instrumentation"""
+
+    effect_class = Bookart
+
+    def test_stats_file(self):
+        """all stages are recorded with their counts"""
+        file_name = os.path.join(self.tempdir, "stats.json")
+        profile_file = os.path.join(self.tempdir, "bookart.prof")
+        self.assertEffect(
+            "svg",
+            "bookart.svg",
+            args=[
+                "--id=woodpecker",
+                f"--stats_file={file_name}",
+                f"--profile_file={profile_file}",
+            ],
+        )
+        # memory tracing doesn't stay on for later runs in the same process
+        self.assertFalse(tracemalloc.is_tracing())
+        stages = load_stages(file_name)
+        self.assertEqual(
+            list(stages),
+            [
+                "settings",
+                "pages",
+                "elements",
+                "pattern_groups",
+                "scale",
+                "bbox",
+                "clips",
+                "lines",
+                "generate_pages",
+                "insert",
+            ],
+        )
+        self.assertEqual(stages["elements"]["counts"]["elements"], 1)
+        self.assertEqual(stages["lines"]["counts"]["pages"], 1)
+        # the memory is only traced on request
+        self.assertIsNone(stages["elements"]["peak_memory"])
+        self.assertTrue(os.path.isfile(profile_file))
+
+    def test_stats_memory(self):
+        """the peak memory is measured within the stages only"""
+        file_name = os.path.join(self.tempdir, "stats.json")
+        run_bookart(
+            ["--id=woodpecker", f"--stats_file={file_name}", "--stats_memory=true"]
+        )
+        self.assertFalse(tracemalloc.is_tracing())
+        for stage in load_stages(file_name).values():
+            self.assertGreaterEqual(stage["peak_memory"], 0)
+
+
+class BookartCacheTest(TestCase):
+    """Test the on-disk geometry cache"""
+
+    def run_cached(self, cache_dir, *args):
+        """runs the extension with the cache, returns output and stages"""
+        stats_file = os.path.join(self.tempdir, "stats.json")
+        output = run_bookart(
+            [
+                "--id=woodpecker",
+                "--keep_pattern_color=true",
+                f"--cache_dir={cache_dir}",
+                f"--stats_file={stats_file}",
+            ]
+            + list(args)
+        )
+        return output, load_stages(stats_file)
+
+    def test_cache_hit(self):
+        """a second run reuses the cached geometry with the same result"""
+        for clip_method in ("clip_path", "scanline"):
+            cache_dir = os.path.join(self.tempdir, clip_method)
+            first, stages = self.run_cached(cache_dir, f"--clip_method={clip_method}")
+            self.assertFalse(stages["pattern_groups"]["counts"]["cache_hit"])
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            second, stages = self.run_cached(cache_dir, f"--clip_method={clip_method}")
+            self.assertTrue(stages["pattern_groups"]["counts"]["cache_hit"])
+            self.assertNotIn("cache", stages)
+            self.assertEqual(first, second)
+
+    def test_cache_size(self):
+        """entries are removed when the cache grows too large"""
+        cache_dir = os.path.join(self.tempdir, "cache")
+        self.run_cached(cache_dir, "--cache_size=0")
+        self.assertEqual(os.listdir(cache_dir), [])
+
+
+class BookartGroupingTest(TestCase):
+    """Test the pattern groups of designs with multiple colors"""
+
+    @staticmethod
+    def pattern_groups(green_x):
+        """returns the pattern groups of a red, green, red design"""
+        svg = design_svg(
+            b'<rect x="0" y="0" width="10" height="10" style="fill:#ff0000"/>'
+            b'<rect x="%d" y="0" width="10" height="10" style="fill:#00ff00"/>'
+            b'<rect x="40" y="0" width="10" height="10" style="fill:#ff0000"/>'
+            % green_x
+        )
+        design = Design(svg, Settings(keep_pattern_color=True))
+        design.elements_to_pattern_groups()
+        return [
+            (str(group.color), len(group.pattern)) for group in design.pattern_groups
+        ]
+
+    def test_merge_colors(self):
+        """elements of the same color are grouped if nothing overlaps in between"""
+        self.assertEqual(self.pattern_groups(20), [("#ff0000", 2), ("#00ff00", 1)])
+
+    def test_keep_order(self):
+        """elements are not moved above overlapping elements of other colors"""
+        self.assertEqual(
+            self.pattern_groups(5),
+            [("#ff0000", 1), ("#00ff00", 1), ("#ff0000", 1)],
+        )
+
+
+class BookartElementsTest(TestCase):
+    """Test the collection of the design elements"""
+
+    def test_skip_elements(self):
+        """defs, hidden subtrees and excluded containers are skipped"""
+        svg = design_svg(
+            b'<defs><path id="def" d="M 0 0 H 5 V 5 Z"/></defs>'
+            b'<g transform="translate(10, 0)"><g transform="scale(2)">'
+            b'<rect id="visible" width="5" height="5"/>'
+            b'<circle id="invisible" r="5" style="visibility:hidden"/></g></g>'
+            b'<g style="display:none"><rect width="5" height="5"/></g>'
+            b'<g id="previous"><path d="M 0 0 H 5 V 5 Z"/></g>'
+        )
+        design = Design(svg, Settings())
+        elements = design.elements(exclude=[svg.getElementById("previous")])
+        self.assertEqual([element.get("id") for element in elements], ["visible"])
+        self.assertEqual(
+            design.composed_transforms[elements[0]], elements[0].composed_transform()
+        )
+        self.assertEqual(
+            design.skipped, {"not_rendered": 1, "hidden": 2, "previous_output": 1}
+        )
+
+    def test_include_defs(self):
+        """elements of included containers in the defs are collected"""
+        svg = design_svg(
+            b'<defs><path id="other" d="M 0 0 H 5 V 5 Z"/><clipPath id="clip">'
+            b'<g transform="scale(2)"><path id="design" d="M 0 0 H 5 V 5 Z"/>'
+            b"</g></clipPath></defs>"
+        )
+        design = Design(svg, Settings())
+        elements = design.elements(include=[svg.getElementById("clip")])
+        self.assertEqual([element.get("id") for element in elements], ["design"])
+        self.assertEqual(
+            design.composed_transforms[elements[0]], elements[0].composed_transform()
+        )
+
+
+class BookartRerunTest(TestCase):
+    """Test runs on the output of a previous run"""
+
+    def run_extension(self, args, input_file):
+        """runs the extension, returns the output and the line stage counts"""
+        stats_file = os.path.join(self.tempdir, "stats.json")
+        output = run_bookart(args + [f"--stats_file={stats_file}"], input_file)
+        return output, load_stages(stats_file)["lines"]["counts"]
+
+    @staticmethod
+    def summary(output):
+        """returns the number of Book Art layers, pages and clip paths"""
+        svg = parse_svg(output)
+        layers = svg.xpath("//svg:g[@inkscape:label='Book Art']")
+        pages = svg.xpath("//svg:g[@data-bookart-page]")
+        return len(layers), len(pages), len(svg.xpath("//svg:clipPath"))
+
+    def rerun(self, first_args, second_args):
+        """runs the extension on its own output"""
+        first, _ = self.run_extension(first_args, SVG_FILE)
+        first_file = os.path.join(self.tempdir, "first.svg")
+        with open(first_file, "wb") as stream:
+            stream.write(first)
+        second, counts = self.run_extension(second_args, first_file)
+        return first, second, counts
+
+    def test_reuse_pages(self):
+        """unchanged pages, the layer and the clip paths are reused"""
+        for clip_method in ("clip_path", "page_clip_path", "scanline"):
+            args = ["--id=woodpecker", "--line_distance=5", "--last_page=300"]
+            args.append(f"--clip_method={clip_method}")
+            first, second, counts = self.rerun(args, args)
+            self.assertEqual(counts["reused_pages"], counts["pages"])
+            # the document isn't written if nothing changed
+            self.assertEqual(second, b"")
+
+    def test_changed_settings(self):
+        """all pages are generated again if the settings change"""
+        _, second, counts = self.rerun(
+            ["--id=woodpecker"], ["--id=woodpecker", "--font_size=3"]
+        )
+        self.assertEqual(counts["reused_pages"], 0)
+        self.assertEqual(self.summary(second), (1, 1, 1))
+
+    def test_keep_design(self):
+        """the design stays in place, the clip references it"""
+        args = ["--id=woodpecker", "--keep_design=true"]
+        first, second, counts = self.rerun(args, args)
+        svg = parse_svg(first)
+        design = svg.getElementById("woodpecker")
+        self.assertEqual(design.getparent(), svg)
+        self.assertIsNone(design.get("transform"))
+        clip = svg.xpath("//svg:clipPath")[0]
+        self.assertEqual([use.href for use in clip.xpath(".//svg:use")], [design])
+        self.assertEqual(counts["reused_pages"], counts["pages"])
+        self.assertEqual(second, b"")
+
+    def test_keep_design_restores(self):
+        """a design moved into the defs by a previous run is moved back"""
+        first, second, counts = self.rerun(
+            ["--id=woodpecker"], ["--id=woodpecker", "--keep_design=true"]
+        )
+        self.assertEqual(counts["reused_pages"], counts["pages"])
+        svg = parse_svg(second)
+        layer = svg.getElementById("woodpecker").getparent().getparent()
+        self.assertEqual(layer.label, "Book Art design")
+        self.assertEqual(self.summary(second), self.summary(first))
+
+
+class BookartPagesDirTest(TestCase):
+    """Test writing each page into a separate file"""
+
+    def test_pages_dir(self):
+        """every page is a standalone svg with the clip paths it uses"""
+        for clip_method in ("clip_path", "page_clip_path", "scanline"):
+            pages_dir = os.path.join(self.tempdir, clip_method)
+            output = run_bookart(
+                [
+                    "--id=woodpecker",
+                    "--line_distance=5",
+                    "--last_page=300",
+                    f"--clip_method={clip_method}",
+                    f"--pages_dir={pages_dir}",
+                ]
+            )
+            # the document itself isn't changed
+            self.assertEqual(output, b"")
+            file_names = sorted(os.listdir(pages_dir))
+            self.assertEqual(file_names[0], "page_0001.svg")
+            self.assertEqual(len(file_names), 4)
+            for file_name in file_names:
+                svg = load_svg(os.path.join(pages_dir, file_name)).getroot()
+                self.assertEqual(len(svg.xpath("//svg:g[@data-bookart-page]")), 1)
+                for clip_id in svg.xpath("//@clip-path"):
+                    self.assertIsNotNone(svg.getElementById(clip_id[5:-1]))
+
+
+class BookartShardTest(TestCase):
+    """Test generating parts of the pages"""
+
+    args = ["--id=woodpecker", "--line_distance=5", "--last_page=300"]
+
+    def run_extension(self, *args):
+        """returns the page groups (sorted) and the document pages (x) of a run"""
+        svg = parse_svg(run_bookart(self.args + list(args)))
+        groups = sorted(
+            group.tostring() for group in svg.xpath("//svg:g[@data-bookart-page]")
+        )
+        pages = [float(page.get("x")) for page in svg.namedview.xpath("inkscape:page")]
+        return groups, pages, svg.get("viewBox").split()[0]
+
+    def test_shards(self):
+        """the shards together are the same as a full run"""
+        for clip_method in ("clip_path", "scanline"):
+            groups, pages, _ = self.run_extension(f"--clip_method={clip_method}")
+            shard_groups, shard_pages = [], []
+            for shard in ("1/3", "2/3", "3/3"):
+                part = self.run_extension(
+                    f"--clip_method={clip_method}", f"--shard={shard}"
+                )
+                shard_groups += part[0]
+                shard_pages += part[1]
+                # the first page of the part is the viewbox
+                self.assertEqual(float(part[2]), part[1][0])
+            self.assertEqual(sorted(shard_groups), groups)
+            self.assertEqual(shard_pages, pages)
+
+    def test_sheets(self):
+        """a sheet range keeps the numbering of the full run"""
+        groups, pages, _ = self.run_extension("--clip_method=scanline")
+        part_groups, part_pages, _ = self.run_extension(
+            "--clip_method=scanline", "--sheets=2-3"
+        )
+        self.assertEqual(len(part_groups), 2)
+        self.assertTrue(set(part_groups) <= set(groups))
+        self.assertEqual(part_pages, pages[1:3])
+
+    def test_pages_dir(self):
+        """page files are named by their page number in the whole book"""
+        pages_dir = os.path.join(self.tempdir, "pages")
+        run_bookart(self.args + ["--shard=2/2", f"--pages_dir={pages_dir}"])
+        self.assertEqual(
+            sorted(os.listdir(pages_dir)), ["page_0003.svg", "page_0004.svg"]
+        )
+
+    def test_invalid(self):
+        """invalid ranges and shards stop the extension"""
+        for args in (
+            ["--sheets=5"],
+            ["--sheets=3-2"],
+            ["--shard=3/2"],
+            ["--shard=5/8"],
+            ["--sheets=1-2", "--pack_pages=true"],
+        ):
+            with self.assertRaises(SystemExit):
+                self.run_extension(*args)
+
+
+class BookartProcessesTest(TestCase):
+    """Test the page generation in worker processes"""
+
+    def test_same_output(self):
+        """the output doesn't depend on the number of processes"""
+        for args in (
+            ["--id=woodpecker", "--line_distance=2", "--clip_method=page_clip_path"],
+            ["--id=woodpecker", "--clip_method=scanline", "--compact=true"],
+        ):
+            with self.subTest(args=args):
+                self.assertEqual(
+                    run_bookart(args), run_bookart(args + ["--processes=2"])
+                )
+
+
+class SettingsTest(TestCase):
+    """Test the settings and their derived values"""
+
+    def test_derived(self):
+        """derived values are computed once from the settings"""
+        settings = Settings(
+            first_page=-6,
+            last_page=100,
+            pages_before=3,
+            line_distance=5,
+            page_margins=10,
+        )
+        self.assertEqual(settings.total_pages, 53)
+        self.assertEqual(settings.design_pages, 50)
+        self.assertEqual((settings.first_line, settings.last_line), (-3, 50))
+        self.assertEqual(settings.content_width, 190)
+        self.assertEqual(settings.lines_per_page, 38)
+        self.assertEqual(settings.num_pages, 2)
+
+    def test_invalid(self):
+        """impossible combinations are refused"""
+        with self.assertRaises(ValueError):
+            Settings(first_page=10, last_page=20, pages_before=3, pages_after=2)
+        with self.assertRaises(ValueError):
+            Settings(page_margins=104.5, line_distance=2)
+        with self.assertRaises(TypeError):
+            Settings(line_spacing=2)
+        with self.assertRaises(ValueError):
+            Settings(clip_method="bogus")
+
+    def test_hashable(self):
+        """equal settings have the same hash"""
+        self.assertEqual(Settings(font_size=2), Settings(font_size=2.0))
+        self.assertEqual(hash(Settings(font_size=2)), hash(Settings(font_size=2.0)))
+        self.assertNotEqual(Settings(font_size=2), Settings(font_size=3))
+        self.assertEqual(len({Settings(), Settings(), Settings(keep_design=True)}), 2)
+
+    def test_frozen(self):
+        """settings can't be changed, also not after pickling"""
+        settings = Settings(line_distance=2)
+        with self.assertRaises(AttributeError):
+            settings.line_distance = 3
+        copy = pickle.loads(pickle.dumps(settings))
+        self.assertEqual(copy, settings)
+        self.assertEqual(copy.num_pages, settings.num_pages)
+        with self.assertRaises(AttributeError):
+            copy.num_pages = 1
+
+    def test_command_line_defaults(self):
+        """the settings defaults are the defaults of the command line options"""
+        options = Bookart().arg_parser.parse_args([])
+        for name in ("first_page", "font_size", "page_margins", "line_distance"):
+            self.assertEqual(getattr(options, name), Settings.DEFAULTS[name])
+
+    def test_abort(self):
+        """the extension stops with a message for impossible settings"""
+        with self.assertRaises(SystemExit):
+            run_bookart(["--last_page=10", "--pages_before=5"])
+        with self.assertRaises(SystemExit):
+            run_bookart(["--clip_method=bogus"])
+
+
+class SheetPackerTest(TestCase):
+    """Test the packing of page groups onto shared pages"""
+
+    def test_no_overlap(self):
+        """rectangles are within the margins and don't overlap"""
+        rng = random.Random(3)
+        sizes = [(rng.uniform(5, 190), rng.uniform(5, 120)) for _ in range(300)]
+        sizes.append((250, 10))
+        placements = SheetPacker(210, 297, 10, spacing=2).pack(sizes)
+        self.assertEqual(placements[-1][1:], (-20, 143.5))
+        pages = {}
+        for (width, height), (page, x, y) in zip(sizes[:-1], placements):
+            self.assertGreaterEqual(x, 10)
+            self.assertGreaterEqual(y, 10)
+            self.assertLessEqual(x + width, 200 + 1e-9)
+            self.assertLessEqual(y + height, 287 + 1e-9)
+            for left, top, right, bottom in pages.get(page, []):
+                self.assertTrue(
+                    x + width + 2 <= left + 1e-9
+                    or right + 2 <= x + 1e-9
+                    or y + height + 2 <= top + 1e-9
+                    or bottom + 2 <= y + 1e-9
+                )
+            pages.setdefault(page, []).append((x, y, x + width, y + height))
+        area = sum(width * height for width, height in sizes[:-1])
+        self.assertLess(len(pages), area / (190 * 277) * 1.6)
+
+    def test_pack_pages(self):
+        """small books share the document pages"""
+        output = run_bookart(
+            [
+                "--id=woodpecker",
+                "--book_height=100",
+                "--line_distance=3",
+                "--last_page=400",
+                "--pack_pages=true",
+            ]
+        )
+        svg = parse_svg(output)
+        self.assertEqual(len(svg.namedview.get_pages()), 2)
+        self.assertEqual(len(svg.xpath("//svg:g[@data-bookart-page]")), 3)
+
+
+class CompactEncoderTest(TestCase):
+    """Test the compact path encoding"""
+
+    def test_numbers(self):
+        """numbers are as short as possible"""
+        encoder = CompactEncoder(3)
+        self.assertEqual(
+            [encoder.coordinate(value) for value in (0, 1.5, -0.25, 2.0004, -3)],
+            ["0", "1.5", "-.25", "2", "-3"],
+        )
+
+    def test_no_drift(self):
+        """rounding errors don't add up along the relative moves"""
+        encoder = CompactEncoder(2)
+        positions = [10 + 0.333 * i for i in range(1000)]
+        path = Path(encoder.lines(positions, 5, 105)).to_absolute()
+        x_values = [segment.x for segment in path if segment.letter == "M"]
+        self.assertEqual(len(x_values), 1000)
+        for x_value, position in zip(x_values, positions):
+            self.assertAlmostEqual(x_value, position, delta=0.005 + 1e-9)
+
+
+class DesignGeometryTest(TestCase):
+    """Test the flattened design geometry"""
+
+    @staticmethod
+    def elements():
+        """returns two equal shapes and a rectangle"""
+        svg = design_svg(
+            b'<path d="M 0 0 L 5 0 L 10 0.001 L 10 10 L 0 10 Z"/>'
+            b'<path d="M 0 0 L 5 0 L 10 0.001 L 10 10 L 0 10 Z"/>'
+            b'<rect x="20" y="30" width="5" height="8" transform="scale(2)"/>'
+        )
+        elements = svg.xpath("//svg:path|//svg:rect")
+        for element in elements:
+            element.transform = element.composed_transform()
+        return elements
+
+    def test_simplify(self):
+        """points within the tolerance are removed"""
+        elements = self.elements()
+        self.assertEqual(len(DesignGeometry.element_polygons(elements[0])[0]), 6)
+        polygon = DesignGeometry.element_polygons(elements[0], simplify=0.01)[0]
+        self.assertEqual(polygon.tolist(), [[0, 0], [10, 0.001], [10, 10], [0, 10]])
+
+    def test_memoized(self):
+        """equal elements share their polygons"""
+        first, second, _ = self.elements()
+        self.assertIs(
+            DesignGeometry.element_polygons(first),
+            DesignGeometry.element_polygons(second),
+        )
+
+    def test_element_bboxes(self):
+        """elements which are not included have no bounding box"""
+        geometry = DesignGeometry.from_elements(self.elements(), [True, False, True])
+        bboxes = geometry.element_bboxes()
+        self.assertEqual(bboxes[0].tolist(), [0, 10, 0, 10])
+        self.assertTrue(np.isnan(bboxes[1]).all())
+        self.assertEqual(bboxes[2].tolist(), [40, 50, 60, 76])
+        self.assertEqual(len(geometry.polygon_bboxes()), 2)
+
+
+class RasterClipTest(TestCase):
+    """Test the raster preview"""
+
+    @staticmethod
+    def design():
+        """returns a scaled design with a ring (evenodd) and two rectangles"""
+        svg = design_svg(
+            b'<path d="M 0 0 H 40 V 40 H 0 Z M 10 10 H 30 V 30 H 10 Z" '
+            b'style="clip-rule:evenodd"/>'
+            b'<rect x="50" y="20" width="30" height="50"/>'
+            b'<rect x="60" y="60" width="5" height="5"/>'
+        )
+        design = Design(svg, Settings(first_page=0, last_page=80, line_distance=1))
+        design.elements_to_pattern_groups()
+        design.design_to_group()
+        design.scale()
+        return design
+
+    def test_same_intervals(self):
+        """the intervals match the scanline clip within a pixel"""
+        design = self.design()
+        clips, skipped = design.raster_clips(0.5)
+        self.assertEqual(skipped, 0)
+        positions = [0.25 + i for i in range(40)]
+        expected = design.scanline_clip().scan(positions, -10, 110)
+        for line, line_intervals in zip(expected, clips[0].scan(positions, -10, 110)):
+            self.assertEqual(len(line), len(line_intervals))
+            for (top, bottom), (raster_top, raster_bottom) in zip(line, line_intervals):
+                self.assertAlmostEqual(top, raster_top, delta=0.5)
+                self.assertAlmostEqual(bottom, raster_bottom, delta=0.5)
+        self.assertEqual(clips[0].count_cuts(positions, -10, 110), 2 * 45)
+
+    def test_time_budget(self):
+        """elements left after the time budget are skipped"""
+        clips, skipped = self.design().raster_clips(0.5, time_budget=-1)
+        self.assertEqual(skipped, 3)
+        self.assertFalse(clips[0].bitmap.any())
+        self.assertIsInstance(clips[0], RasterClip)
+
+
+class PageClipTest(TestCase):
+    """Test the clip paths cropped to a page"""
+
+    def test_holes(self):
+        """holes of evenodd and counter-wound nonzero shapes stay holes"""
+        svg = design_svg(
+            b'<path d="M 0 0 H 40 V 40 H 0 Z M 10 10 H 30 V 30 H 10 Z" '
+            b'style="clip-rule:evenodd"/>'
+            b'<path d="M 50 0 H 90 V 40 H 50 Z M 60 10 V 30 H 80 V 10 Z"/>'
+        )
+        design = Design(svg, Settings(first_page=0, last_page=100, line_distance=1))
+        design.elements_to_pattern_groups()
+        design.design_to_group()
+        design.scale()
+        clip = design.page_clip(design.pattern_groups[0]).crop(5, 85)
+        self.assertEqual(len(clip), 2)
+        cropped = DesignGeometry.from_elements(list(clip))
+        positions = [5.25 + i for i in range(80)]
+        expected = design.scanline_clip().scan(positions, -10, 110)
+        intervals = cropped.scanline_clip(range(len(clip))).scan(positions, -10, 110)
+        self.assertEqual(len(expected[10]), 2)
+        for line, line_intervals in zip(expected, intervals):
+            self.assertEqual(len(line), len(line_intervals))
+            for interval, cropped_interval in zip(line, line_intervals):
+                np.testing.assert_allclose(interval, cropped_interval, atol=1e-3)
@@ -0,0 +1,53 @@
+# coding=utf-8
+"""
+Test the bookart batch runner
+"""
+
+import json
+import os
+
+from inkex.tester import TestCase
+
+from bookart_batch import read_manifest, run_jobs
+
+
+class BookartBatchTest(TestCase):
+    """Run a small manifest with valid and broken jobs"""
+
+    def write_manifest(self, manifest):
+        """writes the manifest into the temp dir and returns the jobs"""
+        manifest_file = os.path.join(self.tempdir, "manifest.json")
+        with open(manifest_file, "w", encoding="utf-8") as stream:
+            json.dump(manifest, stream)
+        return read_manifest(manifest_file, self.tempdir)
+
+    def test_batch(self):
+        """bad jobs are reported and don't stop the other jobs"""
+        jobs = self.write_manifest(
+            {
+                "inputs": [self.data_file("svg", "bookart.svg"), "missing.svg"],
+                "options": {
+                    "small": {"id": "woodpecker", "book_height": 160},
+                    "wide": ["--id=woodpecker", "--line_distance=3"],
+                    "broken": {"line_distance": "wide"},
+                },
+            }
+        )
+        self.assertEqual(len(jobs), 6)
+
+        results = run_jobs(jobs, processes=2, report=lambda line: None)
+        status = {(os.path.basename(r["output"])): r["status"] for r in results}
+        self.assertEqual(
+            status,
+            {
+                "bookart__small.svg": "ok",
+                "bookart__wide.svg": "ok",
+                "bookart__broken.svg": "failed",
+                "missing__small.svg": "failed",
+                "missing__wide.svg": "failed",
+                "missing__broken.svg": "failed",
+            },
+        )
+        for result in results:
+            self.assertEqual(os.path.isfile(result["output"]), result["status"] == "ok")
+            self.assertGreaterEqual(result["time"], 0)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Test the bookart watch mode
+"""
+
+import os
+import shutil
+
+from inkex import load_svg
+from inkex.tester import TestCase
+
+from bookart_watch import Watcher, WatchBookart, regenerate
+
+
+class BookartWatchTest(TestCase):
+    """Regenerate the outputs of changed files"""
+
+    def setUp(self):
+        super().setUp()
+        self.time = 0.0
+        self.watch_dir = os.path.join(self.tempdir, "designs")
+        self.output_dir = os.path.join(self.tempdir, "out")
+        os.makedirs(self.watch_dir)
+        os.makedirs(self.output_dir)
+
+    def add_design(self, name):
+        """copies the test design into the watched folder"""
+        file_name = os.path.join(self.watch_dir, name)
+        shutil.copy(self.data_file("svg", "bookart.svg"), file_name)
+        return file_name
+
+    def touch(self, file_name, mtime):
+        """sets the modification time of a file"""
+        os.utime(file_name, ns=(mtime, mtime))
+
+    def test_debounce(self):
+        """a file is reported once it didn't change for the debounce time"""
+        design = self.add_design("owl.svg")
+        self.touch(design, 1)
+        watcher = Watcher(self.watch_dir, debounce=1, clock=lambda: self.time)
+        self.assertEqual(watcher.poll(), [])
+        self.time = 0.5
+        self.touch(design, 2)
+        self.assertEqual(watcher.poll(), [])
+        self.time = 1.0
+        self.assertEqual(watcher.poll(), [])
+        self.time = 1.5
+        self.assertEqual(watcher.poll(), [(design, 0.5)])
+        self.time = 5
+        self.assertEqual(watcher.poll(), [])
+
+    def test_regenerate_changed(self):
+        """only the output of the changed design is written"""
+        owl = self.add_design("owl.svg")
+        cat = self.add_design("cat.svg")
+        self.touch(owl, 1)
+        self.touch(cat, 1)
+        watcher = Watcher(self.watch_dir, debounce=0, clock=lambda: self.time)
+        extension = WatchBookart(["--id=woodpecker", "--book_height=160"])
+        log = []
+
+        watcher.poll()
+        for input_file, changed in watcher.poll():
+            self.assertTrue(
+                regenerate(extension, input_file, self.output_dir, changed, log.append)
+            )
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["cat.svg", "owl.svg"])
+        svg = load_svg(os.path.join(self.output_dir, "owl.svg")).getroot()
+        self.assertEqual(len(svg.xpath("//svg:g[@data-bookart-page]")), 1)
+
+        os.remove(os.path.join(self.output_dir, "owl.svg"))
+        os.remove(os.path.join(self.output_dir, "cat.svg"))
+        self.touch(cat, 2)
+        watcher.poll()
+        changed_files = watcher.poll()
+        self.assertEqual([input_file for input_file, _ in changed_files], [cat])
+        for input_file, changed in changed_files:
+            regenerate(extension, input_file, self.output_dir, changed, log.append)
+        self.assertEqual(os.listdir(self.output_dir), ["cat.svg"])
+        self.assertEqual(len(log), 3)
+        self.assertTrue(all(line.startswith("ok") for line in log))
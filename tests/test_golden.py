@@ -0,0 +1,186 @@
+# coding=utf-8
+"""
+Golden outputs of the comparison cases
+
+The output of every comparison case is reduced to its structure: the document pages
+and for each page group its position, the extent and number of its lines of each
+color, the labels and the clip paths of the lines (ids are replaced by their order
+of appearance). The summaries are compared with data/golden/golden.json, so that
+changes of the output show up independently of the formatting of the document.
+The runtimes of the cases are part of the benchmarks (test_benchmark.py).
+
+Check the cases directly, update the golden outputs and the reference files of the
+comparison tests with:
+
+    python -m tests.test_golden [--update]
+"""
+
+import argparse
+import json
+import os
+import sys
+import unittest
+
+from inkex import BoundingBox, Path
+from inkex.tester import TestCase
+
+from bookart import PreviousOutput
+from tests import test_bookart
+
+GOLDEN = os.path.join(os.path.dirname(__file__), "data", "golden", "golden.json")
+
+# imported as module, pytest would collect the test classes again
+COMPARISON_TESTS = (test_bookart.BookartTest, test_bookart.BookartPreviewTest)
+
+
+def cases():
+    """returns the arguments of all comparison cases by case name"""
+    return {
+        " ".join(args) or "(defaults)": list(args)
+        for test in COMPARISON_TESTS
+        for args in test.comparisons
+    }
+
+
+def summarize(output):
+    """returns the structure of an output document"""
+    svg = test_bookart.parse_svg(output)
+    ids = {}
+
+    def normalized(clip_id):
+        return ids.setdefault(clip_id, f"clip{len(ids)}")
+
+    groups = []
+    layer = f"//svg:g[@inkscape:label='{PreviousOutput.LABEL}']/svg:g"
+    for group in svg.xpath(layer):
+        lines = []
+        clips = []
+        extent = BoundingBox()
+        for path in group.xpath("./svg:path"):
+            path_data = Path(path.get("d"))
+            lines.append(sum(1 for command in path_data if command.letter in "Mm"))
+            extent += path_data.bounding_box()
+            clip = path.get("clip-path")
+            if clip is None:
+                clips.append(None)
+                continue
+            clip = svg.getElementById(clip[5:-1])
+            clips.append([normalized(clip.get("id")), len(clip)])
+        if extent:
+            extent = [extent.left, extent.right, extent.top, extent.bottom]
+            extent = [round(value, 2) for value in extent]
+        else:
+            extent = None
+        labels = [
+            [tspan.text, round(float(tspan.get("x")), 2)]
+            for tspan in group.xpath(".//svg:tspan")
+        ]
+        groups.append(
+            {
+                "translate": [round(group.transform.e, 3), round(group.transform.f, 3)],
+                "extent": extent,
+                "lines": lines,
+                "labels": sorted(labels, key=lambda label: (label[1], label[0])),
+                "clips": clips,
+            }
+        )
+    return {"pages": len(svg.namedview.get_pages()), "groups": groups}
+
+
+def differences(name, summary, golden):
+    """returns a list of the structural differences to the golden summary"""
+    if golden is None:
+        return [f"{name}: no golden output (run with --update)"]
+    found = []
+    if summary["pages"] != golden["pages"]:
+        found.append(f"{name}: {summary['pages']} pages != {golden['pages']}")
+    if len(summary["groups"]) != len(golden["groups"]):
+        found.append(
+            f"{name}: {len(summary['groups'])} page groups != {len(golden['groups'])}"
+        )
+    for i, (group, golden_group) in enumerate(zip(summary["groups"], golden["groups"])):
+        for key, value in group.items():
+            if value != golden_group.get(key):
+                found.append(
+                    f"{name}: page group {i} {key} {value} != {golden_group.get(key)}"
+                )
+    return found
+
+
+def run_cases():
+    """returns the summaries of all cases"""
+    return {
+        name: summarize(test_bookart.run_bookart(args))
+        for name, args in cases().items()
+    }
+
+
+def load_golden():
+    """returns the stored golden outputs"""
+    if not os.path.isfile(GOLDEN):
+        return {}
+    with open(GOLDEN, encoding="utf-8") as stream:
+        return json.load(stream)
+
+
+def update_refs():
+    """overwrites the reference files of the comparison tests"""
+    os.environ["EXPORT_COMPARE"] = "3"
+    try:
+        suite = unittest.TestSuite(
+            unittest.defaultTestLoader.loadTestsFromTestCase(test)
+            for test in COMPARISON_TESTS
+        )
+        unittest.TextTestRunner(verbosity=0).run(suite)
+    finally:
+        del os.environ["EXPORT_COMPARE"]
+
+
+def main(args=None):
+    """check or update the golden outputs from the command line"""
+    parser = argparse.ArgumentParser(description="bookart golden outputs")
+    parser.add_argument("--update", action="store_true")
+    options = parser.parse_args(args)
+
+    golden = load_golden()
+    results = run_cases()
+    failed = []
+    for name, summary in results.items():
+        found = differences(name, summary, golden.get(name))
+        print(f"{'differs' if found else 'ok':8} {name}")
+        failed.extend(found)
+
+    if options.update:
+        update_refs()
+        os.makedirs(os.path.dirname(GOLDEN), exist_ok=True)
+        with open(GOLDEN, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, indent=1, sort_keys=True)
+    elif failed:
+        print("\n".join(["Differences:"] + failed))
+        return 1
+    return 0
+
+
+class GoldenTest(TestCase):
+    """Compare the structure of the comparison outputs with the golden outputs"""
+
+    def test_golden(self):
+        """outputs have the golden structure"""
+        golden = load_golden()
+        failed = []
+        for name, summary in run_cases().items():
+            failed.extend(differences(name, summary, golden.get(name)))
+        self.assertFalse(failed, "\n".join(failed))
+
+    def test_refs(self):
+        """every comparison case has a non empty reference file"""
+        for test in COMPARISON_TESTS:
+            method = next(name for name in dir(test) if name.startswith("test_"))
+            for args in test.comparisons:
+                cmpfile = test(method).get_compare_cmpfile(args)
+                self.assertTrue(os.path.isfile(cmpfile), cmpfile)
+                self.assertGreater(os.path.getsize(cmpfile), 0, cmpfile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())